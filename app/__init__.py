@@ -1,6 +1,7 @@
 import os
+import time
 
-from flask import Flask
+from flask import Flask, g, request
 from flask_mongoengine import MongoEngine
 from flask_login import LoginManager
 from flask_mail import Mail
@@ -8,8 +9,19 @@ from flask_bootstrap import Bootstrap
 from flask_babel import Babel
 from flask_socketio import SocketIO
 from werkzeug.contrib.fixers import ProxyFix
+from pymongo import monitoring
 
 from app.service.service_manager import ServiceManager
+from app.service.emitter import CoalescingEmitter
+from app.service.logo_validator import LogoValidator
+from app.service.m3u_import import M3uImportManager
+from app.service.playlist_cache import PlaylistCache
+from app.service.ipc import IpcClient
+from app.service.remote_service import RemoteServiceManager, RemotePlaylistCache
+from app.service.membership import Membership
+from app.metrics.metrics import MongoCommandListener, HTTP_TIME
+
+SERVICE_DAEMON_ENV = 'IPTV_ADMIN_SERVICE_DAEMON'
 
 
 def get_app_folder():
@@ -24,6 +36,10 @@ def get_runtime_stream_folder():
     return os.path.join(get_runtime_folder(), 'stream')
 
 
+def is_service_daemon() -> bool:
+    return bool(os.environ.get(SERVICE_DAEMON_ENV))
+
+
 def init_project(static_folder, *args):
     runtime_folder = get_runtime_folder()
     if not os.path.exists(runtime_folder):
@@ -40,13 +56,28 @@ def init_project(static_folder, *args):
     app.wsgi_app = ProxyFix(app.wsgi_app)
     bootstrap = Bootstrap(app)
     babel = Babel(app)
+    # listeners must be registered before the first MongoClient is created
+    monitoring.register(MongoCommandListener())
     db = MongoEngine(app)
+    Membership.ensure_indexes()
     mail = Mail(app)
-    socketio = SocketIO(app)
+    socketio = SocketIO(app, message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'))
     login_manager = LoginManager(app)
 
     login_manager.login_view = "HomeView:signin"
 
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.monotonic()
+
+    @app.after_request
+    def observe_request_time(response):
+        start = g.get('request_start')
+        if start is not None:
+            HTTP_TIME.observe(time.monotonic() - start, request.method, request.endpoint or 'unknown',
+                              response.status_code)
+        return response
+
     # socketio
     @socketio.on('connect')
     def connect():
@@ -54,7 +85,28 @@ def init_project(static_folder, *args):
 
     @socketio.on('disconnect')
     def disconnect():
-        pass
+        servers_manager.detach_client(request.sid)
+
+    # every dashboard gets its own bounded queue, see CoalescingEmitter
+    @socketio.on('join_service')
+    def join_service(data):
+        from flask_login import current_user
+        if not current_user.is_authenticated:
+            return
+
+        sid = data.get('id')
+        for server in current_user.servers:
+            if str(server.id) == sid:
+                servers_manager.attach_client(request.sid, sid)
+                break
+
+    @socketio.on('snapshot_service')
+    def snapshot_service(data):
+        servers_manager.request_snapshot(request.sid)
+
+    @socketio.on('leave_service')
+    def leave_service(data):
+        servers_manager.detach_client(request.sid)
 
     # defaults flask
     _host = '0.0.0.0'
@@ -67,12 +119,35 @@ def init_project(static_folder, *args):
 
     host = sn_host or _host
     port = int(sn_port or _port)
-    servers_manager = ServiceManager(host, port, socketio)
-
-    return app, bootstrap, babel, db, mail, login_manager, servers_manager
-
-
-app, bootstrap, babel, db, mail, login_manager, servers_manager = init_project(
+    manager_socket = app.config.get('SERVICE_MANAGER_SOCKET')
+    if manager_socket and not is_service_daemon():
+        ipc_client = IpcClient(manager_socket)
+        playlist_cache = RemotePlaylistCache(ipc_client)
+        servers_manager = RemoteServiceManager(ipc_client)
+    else:
+        playlist_cache = PlaylistCache()
+        servers_manager = ServiceManager(host, port, socketio, app.config.get('SOCKETIO_EMIT_WINDOW_MSEC', 0),
+                                         playlist_cache,
+                                         app.config.get('SERVICE_CONNECT_CONCURRENCY',
+                                                        ServiceManager.DEFAULT_CONNECT_CONCURRENCY),
+                                         app.config.get('SERVICE_RECONNECT_MAX_SEC',
+                                                        ServiceManager.DEFAULT_RECONNECT_MAX_SEC),
+                                         app.config.get('SOCKETIO_CLIENT_QUEUE_SIZE',
+                                                        CoalescingEmitter.DEFAULT_CLIENT_QUEUE_SIZE))
+    logo_validator = LogoValidator(os.path.join(runtime_folder, 'logo_cache.json'),
+                                   app.config.get('LOGO_VALIDATOR_WORKERS', LogoValidator.DEFAULT_WORKERS),
+                                   app.config.get('LOGO_VALIDATOR_PER_HOST', LogoValidator.DEFAULT_PER_HOST),
+                                   app.config.get('LOGO_VALIDATOR_TTL', LogoValidator.DEFAULT_TTL),
+                                   app.config.get('LOGO_VALIDATOR_TIMEOUT', LogoValidator.DEFAULT_TIMEOUT))
+    import_manager = M3uImportManager(runtime_folder, logo_validator,
+                                      app.config.get('M3U_IMPORT_CHUNK_SIZE', M3uImportManager.DEFAULT_CHUNK_SIZE))
+
+    return (app, bootstrap, babel, db, mail, login_manager, servers_manager, logo_validator, import_manager,
+            playlist_cache)
+
+
+(app, bootstrap, babel, db, mail, login_manager, servers_manager, logo_validator, import_manager,
+ playlist_cache) = init_project(
     'static',
     'config/public_config.py',
     'config/config.py',
@@ -84,8 +159,10 @@ from app.home.view import HomeView
 from app.provider.view import ProviderView
 from app.stream.view import StreamView
 from app.service.view import ServiceView
+from app.metrics.view import MetricsView
 
 HomeView.register(app)
 ProviderView.register(app)
 StreamView.register(app)
 ServiceView.register(app)
+MetricsView.register(app)
@@ -3,4 +3,21 @@ SERVER_NAME_FOR_POST = '0.0.0.0:8080'
 PREFERRED_URL_SCHEME = 'http'
 
 BOOTSTRAP_SERVE_LOCAL = True
-SUBSCRIBERS_SUPPORT = False
\ No newline at end of file
+SUBSCRIBERS_SUPPORT = False
+SOCKETIO_EMIT_WINDOW_MSEC = 250
+SOCKETIO_CLIENT_QUEUE_SIZE = 1000
+LOGO_VALIDATOR_WORKERS = 16
+LOGO_VALIDATOR_PER_HOST = 4
+LOGO_VALIDATOR_TTL = 86400
+LOGO_VALIDATOR_TIMEOUT = 2
+M3U_IMPORT_CHUNK_SIZE = 500
+LOG_UPLOAD_MAX_SIZE = 64 * 1024 * 1024
+SUBSCRIBER_IMPORT_BATCH_SIZE = 1000
+SUBSCRIBER_IMPORT_HASH_WORKERS = 4
+SERVICE_CONNECT_ON_STARTUP = True
+SERVICE_CONNECT_CONCURRENCY = 32
+SERVICE_RECONNECT_MAX_SEC = 30
+METRICS_ALLOWED_HOSTS = ['127.0.0.1']  # None exposes /metrics to everyone
+# set both to run FastoCloud connections in service_daemon.py and several web workers
+SERVICE_MANAGER_SOCKET = None  # e.g. '/tmp/iptv_admin.sock'
+SOCKETIO_MESSAGE_QUEUE = None  # e.g. 'redis://localhost:6379/0'
@@ -1,7 +1,10 @@
 from flask import session
 from flask_login import UserMixin, login_user, logout_user
+from mongoengine import signals
 
 from app.common.provider.entry import Provider
+from app.common.service.entry import ServiceSettings
+from app.home.user_cache import UserCache
 
 SERVER_POSITION_SESSION_FIELD = 'server_position'
 
@@ -30,6 +33,24 @@ class ProviderUser(UserMixin, Provider):
 
         return None
 
+    def save(self, *args, **kwargs):
+        result = super(ProviderUser, self).save(*args, **kwargs)
+        user_cache.invalidate(self.id)
+        return result
+
+    def delete(self, *args, **kwargs):
+        user_cache.invalidate(self.id)
+        return super(ProviderUser, self).delete(*args, **kwargs)
+
     @classmethod
     def make_provider(cls, email: str, password: str, country: str):
         return cls(email=email, password=Provider.generate_password_hash(password), country=country)
+
+
+def _on_server_changed(sender, document, **kwargs):
+    user_cache.invalidate_server(document.id)
+
+
+user_cache = UserCache(lambda uid: ProviderUser.objects(pk=uid).as_pymongo().first(), ProviderUser._from_son)
+signals.post_save.connect(_on_server_changed, sender=ServiceSettings)
+signals.post_delete.connect(_on_server_changed, sender=ServiceSettings)
@@ -0,0 +1,81 @@
+import copy
+import time
+from collections import OrderedDict
+
+
+class UserCache(object):
+    DEFAULT_MAX_SIZE = 1024
+    DEFAULT_TTL = 60
+    SERVERS_FIELD = 'servers'
+
+    # only raw documents are cached, every get builds a fresh object so requests never share one
+    def __init__(self, loader, builder, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self._loader = loader
+        self._builder = builder
+        self._max_size = max_size
+        self._ttl = ttl
+        self._users = OrderedDict()
+        self._server_users = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid):
+        key = str(uid)
+        cached = self._users.get(key)
+        if cached:
+            son, expires = cached
+            if expires > time.monotonic():
+                self._users.move_to_end(key)
+                self.hits += 1
+                return self._builder(copy.deepcopy(son))
+            self.__remove(key)
+
+        self.misses += 1
+        son = self._loader(uid)
+        if not son:
+            return None
+
+        self.__store(key, son)
+        return self._builder(copy.deepcopy(son))
+
+    def invalidate(self, uid):
+        self.__remove(str(uid))
+
+    def invalidate_server(self, sid):
+        for key in list(self._server_users.get(str(sid), ())):
+            self.__remove(key)
+
+    def clear(self):
+        self._users.clear()
+        self._server_users.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._users), 'hits': self.hits, 'misses': self.misses}
+
+    # private
+    def __store(self, key: str, son):
+        self.__remove(key)
+        self._users[key] = (son, time.monotonic() + self._ttl)
+        for sid in UserCache.__server_ids(son):
+            self._server_users.setdefault(sid, set()).add(key)
+
+        while len(self._users) > self._max_size:
+            self.__remove(next(iter(self._users)))
+
+    def __remove(self, key: str):
+        cached = self._users.pop(key, None)
+        if not cached:
+            return
+
+        son, _ = cached
+        for sid in UserCache.__server_ids(son):
+            users = self._server_users.get(sid)
+            if users is not None:
+                users.discard(key)
+                if not users:
+                    del self._server_users[sid]
+
+    @staticmethod
+    def __server_ids(son) -> list:
+        # references are stored as ObjectId or DBRef
+        return [str(getattr(ref, 'id', ref)) for ref in son.get(UserCache.SERVERS_FIELD) or []]
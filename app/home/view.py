@@ -8,7 +8,7 @@ from itsdangerous import SignatureExpired, URLSafeTimedSerializer
 import app.common.constants as constants
 from app.common.utils.utils import is_valid_email, get_country_code_by_remote_addr
 from app import app, mail, login_manager, babel
-from app.home.entry import ProviderUser, login_user_wrap
+from app.home.entry import ProviderUser, login_user_wrap, user_cache
 from app.home.forms import ContactForm
 from app.common.provider.forms import SignupForm, SigninForm
 
@@ -163,7 +163,7 @@ class HomeView(FlaskView):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return ProviderUser.objects(pk=user_id).first()
+    return user_cache.get(user_id)
 
 
 @babel.localeselector
@@ -0,0 +1,254 @@
+import bisect
+import time
+
+from pymongo import monitoring
+
+
+class MetricType:
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def samples(self) -> list:
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in list(self._values.items())]
+
+    def remove(self, *values):
+        self._values.pop(tuple(str(value) for value in values), None)
+
+    def clear(self):
+        self._values = {}
+
+    # private
+    def _key(self, values) -> tuple:
+        return tuple(str(value) for value in values)
+
+
+class Counter(Metric):
+    TYPE = MetricType.COUNTER
+
+    def inc(self, *values, amount=1):
+        key = self._key(values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = MetricType.GAUGE
+
+    def set(self, value, *values):
+        self._values[self._key(values)] = value
+
+
+class Histogram(Metric):
+    TYPE = MetricType.HISTOGRAM
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount: float, *values):
+        key = self._key(values)
+        state = self._values.get(key)
+        if state is None:
+            # per bucket counts (not cumulative), then sum and count
+            state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[key] = state
+
+        state[0][bisect.bisect_left(self.buckets, amount)] += 1
+        state[1] += amount
+        state[2] += 1
+
+    def time(self, *values):
+        return HistogramTimer(self, values)
+
+    def samples(self) -> list:
+        result = []
+        for key, (counts, total, count) in list(self._values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = dict(labels, le='+Inf' if bound == float('inf') else repr(bound))
+                result.append((self.name + '_bucket', bucket_labels, cumulative))
+            result.append((self.name + '_sum', labels, total))
+            result.append((self.name + '_count', labels, count))
+        return result
+
+
+class HistogramTimer(object):
+    __slots__ = ['_histogram', '_values', '_start']
+
+    def __init__(self, histogram: Histogram, values: tuple):
+        self._histogram = histogram
+        self._values = values
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.monotonic() - self._start, *self._values)
+
+
+class MetricsRegistry(object):
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self.__register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels=()) -> Gauge:
+        return self.__register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector):
+        # called right before every collect, used for values that are cheaper to read than to track
+        self._collectors.append(collector)
+
+    def collect(self) -> list:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print('Caught exception while collecting metrics: {0}'.format(e))
+
+        return [{'name': metric.name, 'type': metric.TYPE, 'help': metric.documentation,
+                 'samples': metric.samples()} for metric in self._metrics.values()]
+
+    @staticmethod
+    def render(families: list, extra_labels=None) -> str:
+        lines = []
+        for family in families:
+            lines.append('# HELP {0} {1}'.format(family['name'], family['help']))
+            lines.append('# TYPE {0} {1}'.format(family['name'], family['type']))
+            for name, labels, value in family['samples']:
+                if extra_labels:
+                    labels = dict(labels, **extra_labels)
+                lines.append('{0}{1} {2}'.format(name, MetricsRegistry.__format_labels(labels), float(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def merge(*sources) -> list:
+        # sources are (families, extra labels) pairs collected by different processes
+        merged = {}
+        for families, extra_labels in sources:
+            for family in families:
+                target = merged.setdefault(family['name'], {'name': family['name'], 'type': family['type'],
+                                                            'help': family['help'], 'samples': []})
+                for name, labels, value in family['samples']:
+                    target['samples'].append((name, dict(labels, **(extra_labels or {})), value))
+        return list(merged.values())
+
+    # private
+    def __register(self, metric: Metric):
+        existing = self._metrics.get(metric.name)
+        if existing:
+            return existing
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    @staticmethod
+    def __format_labels(labels: dict) -> str:
+        if not labels:
+            return ''
+
+        pairs = []
+        for key, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+            pairs.append('{0}="{1}"'.format(key, value))
+        return '{' + ','.join(pairs) + '}'
+
+
+registry = MetricsRegistry()
+
+# service connections
+LOOP_ITERATIONS = registry.counter('iptv_loop_iterations_total', 'Poll loop wakeups')
+LOOP_LAG = registry.histogram('iptv_loop_lag_seconds', 'Delay of a periodic gevent timer over its interval')
+DISPATCH_TIME = registry.histogram('iptv_dispatch_seconds', 'Time spent reading one service socket', ['service'])
+MESSAGES = registry.counter('iptv_service_messages_total', 'Messages received from services',
+                            ['service', 'kind', 'method'])
+HANDLER_TIME = registry.histogram('iptv_service_handler_seconds', 'Time spent handling one service message',
+                                  ['service', 'kind'])
+RECV_BATCH_FRAMES = registry.histogram('iptv_recv_batch_frames', 'Frames decoded per socket wakeup',
+                                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+RECV_BATCH_BYTES = registry.histogram('iptv_recv_batch_bytes', 'Bytes read per socket wakeup',
+                                      buckets=(512, 4 * 1024, 32 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024))
+SYNC_PAYLOAD = registry.histogram('iptv_sync_payload_bytes', 'Size of stream and subscriber configs sent on sync',
+                                  ['service'], buckets=(1024, 16 * 1024, 128 * 1024, 1024 * 1024, 8 * 1024 * 1024,
+                                                        64 * 1024 * 1024))
+SERVICE_CONNECTED = registry.gauge('iptv_service_connected', 'Whether the service socket is connected', ['service'])
+SERVICE_RECONNECTS = registry.counter('iptv_service_reconnects_total', 'Automatic reconnect attempts', ['service'])
+RPC_LATENCY = registry.histogram('iptv_rpc_latency_seconds', 'Time from sending a request to its response',
+                                 ['method'])
+RPC_TIMEOUTS = registry.counter('iptv_rpc_timeouts_total', 'Requests that got no response before their deadline',
+                                ['service', 'method'])
+RPC_CANCELLED = registry.counter('iptv_rpc_cancelled_total', 'Requests dropped because the service disconnected',
+                                 ['service', 'method'])
+CLIENT_QUEUE_DEPTH = registry.gauge('iptv_client_queue_depth', 'Updates waiting for one dashboard client', ['client'])
+CLIENT_DROPPED = registry.gauge('iptv_client_dropped', 'Stale updates dropped for one dashboard client', ['client'])
+CLIENT_DROPS = registry.counter('iptv_client_drops_total', 'Stale updates dropped for all dashboard clients',
+                                ['reason'])
+FRONT_UPDATES = registry.counter('iptv_front_updates_total', 'Updates queued for the browser', ['service', 'channel'])
+SOCKETIO_EMITS = registry.counter('iptv_socketio_emits_total', 'Frames emitted to socketio rooms', ['channel'])
+
+# storage and web
+DB_TIME = registry.histogram('iptv_db_command_seconds', 'MongoDB command latency', ['command'])
+DB_FAILURES = registry.counter('iptv_db_command_failures_total', 'Failed MongoDB commands', ['command'])
+HTTP_TIME = registry.histogram('iptv_http_request_seconds', 'Flask request handling time',
+                               ['method', 'endpoint', 'status'])
+
+
+class LoopLagMonitor(object):
+    INTERVAL = 0.5
+
+    def __init__(self, interval=INTERVAL):
+        self._interval = interval
+        self._greenlet = None
+
+    def start(self):
+        import gevent
+        if not self._greenlet:
+            self._greenlet = gevent.spawn(self.__run)
+
+    def stop(self):
+        if self._greenlet:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    # private
+    def __run(self):
+        import gevent
+        while True:
+            start = time.monotonic()
+            gevent.sleep(self._interval)
+            LOOP_LAG.observe(max(0.0, time.monotonic() - start - self._interval))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DB_TIME.observe(event.duration_micros / 1000000.0, event.command_name)
+
+    def failed(self, event):
+        DB_TIME.observe(event.duration_micros / 1000000.0, event.command_name)
+        DB_FAILURES.inc(event.command_name)
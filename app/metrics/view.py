@@ -0,0 +1,23 @@
+from flask_classy import FlaskView, route
+from flask import request, Response, abort
+
+from app import app, servers_manager
+from app.metrics.metrics import registry, MetricsRegistry
+from app.service.remote_service import RemoteServiceManager
+
+
+# routes
+class MetricsView(FlaskView):
+    route_base = "/"
+
+    @route('/metrics', methods=['GET'])
+    def metrics(self):
+        allowed = app.config.get('METRICS_ALLOWED_HOSTS')
+        if allowed is not None and request.remote_addr not in allowed:
+            abort(403)
+
+        sources = [(registry.collect(), None)]
+        if isinstance(servers_manager, RemoteServiceManager):
+            sources.append((servers_manager.collect_metrics(), {'process': 'daemon'}))
+        return Response(MetricsRegistry.render(MetricsRegistry.merge(*sources)),
+                        content_type=MetricsRegistry.CONTENT_TYPE)
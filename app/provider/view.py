@@ -2,8 +2,10 @@ from flask_classy import FlaskView, route
 from flask import render_template, redirect, url_for, request
 from flask_login import login_required, current_user
 
+from app import servers_manager
 from app.common.provider.forms import SettingsForm
-from app.common.service.entry import ServiceSettings
+from app.service.membership import Membership
+from app.service.stream_listing import StreamKind
 
 
 # routes
@@ -14,13 +16,25 @@ class ProviderView(FlaskView):
     def dashboard(self):
         server = current_user.get_current_server()
         if server:
-            streams = server.get_streams()
+            args = request.args.to_dict()
             front_streams = []
-            for stream in streams:
-                front_streams.append(stream.to_front())
+            pages = {}
+            for kind in StreamKind.ALL:
+                cursor_key = '{0}_cursor'.format(kind)
+                page = server.list_streams(kind=kind, sort=args.get('sort', 'name'), order=args.get('order', 'asc'),
+                                           name=args.get('name'), tag=args.get('tag'), group=args.get('group'),
+                                           cursor=args.get(cursor_key))
+                front_streams.extend(page['streams'])
+                next_url = None
+                if page['next_cursor']:
+                    next_url = url_for('ProviderView:dashboard', **dict(args, **{cursor_key: page['next_cursor']}))
+                pages[kind] = {'shown': len(page['streams']), 'total': page['total'], 'next_url': next_url,
+                               'first_url': url_for('ProviderView:dashboard',
+                                                    **{key: value for key, value in args.items() if key != cursor_key})}
+
             role = server.get_user_role_by_id(current_user.id)
-            return render_template('provider/dashboard.html', streams=front_streams, service=server,
-                                   servers=current_user.servers, role=role)
+            return render_template('provider/dashboard.html', streams=front_streams, pages=pages, filters=args,
+                                   service=server, servers=current_user.servers, role=role)
 
         return redirect(url_for('ProviderView:settings'))
 
@@ -51,9 +65,8 @@ class ProviderView(FlaskView):
 
     @login_required
     def remove(self):
-        servers = ServiceSettings.objects()
-        for server in servers:
-            server.remove_provider(current_user)
-
+        server_ids = Membership.remove_provider_everywhere(current_user.id)
         current_user.delete()
+        for server_id in server_ids:
+            servers_manager.reload_providers(server_id)
         return redirect(url_for('HomeView:index'))
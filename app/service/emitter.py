@@ -0,0 +1,192 @@
+import time
+
+import gevent
+
+from app.metrics.metrics import SOCKETIO_EMITS, CLIENT_DROPS
+
+
+class ClientQueue(object):
+    __slots__ = ['sid', 'room', 'pending', 'size', 'seq', 'in_flight', 'in_flight_since', 'synced', 'dropped',
+                 'sent']
+
+    def __init__(self, sid: str, room: str):
+        self.sid = sid
+        self.room = room
+        self.pending = {}
+        self.size = 0
+        self.seq = {}
+        self.in_flight = 0
+        self.in_flight_since = 0.0
+        # channels that got a snapshot, deltas for the others are useless to the client
+        self.synced = set()
+        self.dropped = 0
+        self.sent = 0
+
+    def push(self, channel: str, items: list, max_size: int):
+        if channel not in self.synced:
+            # the next frame of this channel is a full snapshot anyway
+            return
+
+        queued = self.pending.setdefault(channel, {})
+        for item in items:
+            key = item[CoalescingEmitter.ID_FIELD]
+            existing = queued.get(key)
+            if existing is not None:
+                # newer fields replace the unsent ones
+                existing.update(item)
+                self.dropped += 1
+                CLIENT_DROPS.inc('replaced')
+                continue
+
+            if self.size >= max_size:
+                # too far behind, forget the deltas and resync from a snapshot
+                self.dropped += self.size
+                CLIENT_DROPS.inc('overflow', amount=self.size)
+                self.resync()
+                return
+
+            queued[key] = dict(item)
+            self.size += 1
+
+    def clear(self):
+        self.pending = {}
+        self.size = 0
+
+    def resync(self):
+        self.clear()
+        self.synced = set()
+
+    def to_dict(self) -> dict:
+        return {'room': self.room, 'depth': self.size, 'in_flight': self.in_flight, 'dropped': self.dropped,
+                'sent': self.sent}
+
+
+class CoalescingEmitter(object):
+    ID_FIELD = 'id'
+    DEFAULT_CLIENT_QUEUE_SIZE = 1000
+    ACK_TIMEOUT = 30
+
+    def __init__(self, socketio, window_msec: int, client_queue_size=DEFAULT_CLIENT_QUEUE_SIZE):
+        self._socketio = socketio
+        self._window = window_msec / 1000.0
+        self._client_queue_size = client_queue_size
+        self._pending = {}
+        self._flusher = None
+        # last full payload sent per (channel, room) and key, used to encode deltas
+        self._sent = {}
+        self._channels = {}
+        self._clients = {}
+        self._rooms = {}
+
+    def emit(self, channel: str, room: str, key: str, payload: dict):
+        if self._window <= 0:
+            self.__send(channel, room, {key: payload})
+            return
+
+        self._pending.setdefault((channel, room), {})[key] = payload
+        if not self._flusher:
+            self._flusher = gevent.spawn_later(self._window, self.flush)
+
+    def flush(self):
+        self._flusher = None
+        pending, self._pending = self._pending, {}
+        for (channel, room), updates in pending.items():
+            self.__send(channel, room, updates)
+
+    def attach(self, client_sid: str, room: str):
+        self.detach(client_sid)
+        client = ClientQueue(client_sid, room)
+        self._clients[client_sid] = client
+        self._rooms.setdefault(room, set()).add(client_sid)
+        self.__pump(client)
+
+    def detach(self, client_sid: str):
+        client = self._clients.pop(client_sid, None)
+        if not client:
+            return
+
+        members = self._rooms.get(client.room)
+        if members is not None:
+            members.discard(client_sid)
+            if not members:
+                del self._rooms[client.room]
+
+    def request_snapshot(self, client_sid: str):
+        client = self._clients.get(client_sid)
+        if client:
+            client.resync()
+            self.__pump(client)
+
+    def client_stats(self) -> dict:
+        return {sid: client.to_dict() for sid, client in self._clients.items()}
+
+    def forget(self, channel: str, room: str, key: str):
+        sent = self._sent.get((channel, room))
+        if sent:
+            sent.pop(key, None)
+
+    # private
+    def __send(self, channel: str, room: str, updates: dict):
+        self._channels.setdefault(room, set()).add(channel)
+        sent = self._sent.setdefault((channel, room), {})
+        items = []
+        for key, payload in updates.items():
+            last = sent.get(key)
+            sent[key] = payload
+            if last is None:
+                items.append(payload)
+                continue
+
+            delta = {field: value for field, value in payload.items() if last.get(field) != value}
+            if delta:
+                delta[CoalescingEmitter.ID_FIELD] = payload.get(CoalescingEmitter.ID_FIELD, key)
+                items.append(delta)
+
+        if not items:
+            return
+
+        for client_sid in list(self._rooms.get(room, ())):
+            client = self._clients[client_sid]
+            client.push(channel, items, self._client_queue_size)
+            self.__pump(client)
+
+    def __pump(self, client: ClientQueue):
+        if client.in_flight:
+            if time.monotonic() - client.in_flight_since < CoalescingEmitter.ACK_TIMEOUT:
+                return
+            # acks got lost, whatever was in flight may be too
+            client.resync()
+
+        frames = {}
+        for channel in self._channels.get(client.room, ()):
+            if channel not in client.synced:
+                frames[channel] = {'snapshot': True,
+                                   'items': list(self._sent.get((channel, client.room), {}).values())}
+                client.synced.add(channel)
+        for channel, items in client.pending.items():
+            if items and channel not in frames:
+                frames[channel] = {'items': list(items.values())}
+        client.clear()
+        if not frames:
+            client.in_flight = 0
+            return
+
+        client.in_flight = len(frames)
+        client.in_flight_since = time.monotonic()
+        for channel, frame in frames.items():
+            seq = client.seq.get(channel, 0) + 1
+            client.seq[channel] = seq
+            frame['seq'] = seq
+            self._socketio.emit(channel, frame, room=client.sid,
+                                callback=lambda *args, sid=client.sid: self.__on_ack(sid))
+            client.sent += 1
+            SOCKETIO_EMITS.inc(channel)
+
+    def __on_ack(self, client_sid: str):
+        client = self._clients.get(client_sid)
+        if not client or not client.in_flight:
+            return
+
+        client.in_flight -= 1
+        if not client.in_flight:
+            self.__pump(client)
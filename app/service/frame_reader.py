@@ -0,0 +1,78 @@
+import struct
+
+from gevent import select
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameReader(object):
+    HEADER = struct.Struct('>I')
+    INITIAL_SIZE = 256 * 1024
+    MAX_READ_PER_WAKEUP = 4 * 1024 * 1024
+    MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, initial_size=INITIAL_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self._initial_size = initial_size
+        self._max_frame_size = max_frame_size
+        self._buffer = bytearray(initial_size)
+        self._start = 0
+        self._end = 0
+
+    def reset(self):
+        self._start = 0
+        self._end = 0
+
+    def read_available(self, sock) -> int:
+        # the caller got a readiness event, so the first recv won't block; keep going while more is queued
+        total = 0
+        while total < FrameReader.MAX_READ_PER_WAKEUP:
+            self.__reserve(FrameReader.INITIAL_SIZE // 4)
+            with memoryview(self._buffer) as view:
+                read = sock.recv_into(view[self._end:])
+            if not read:
+                return -1 if not total else total
+
+            self._end += read
+            total += read
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                break
+        return total
+
+    def frames(self) -> list:
+        result = []
+        header_size = FrameReader.HEADER.size
+        while self._end - self._start >= header_size:
+            size = FrameReader.HEADER.unpack_from(self._buffer, self._start)[0]
+            if size > self._max_frame_size:
+                raise FrameError('frame size {0} exceeds limit'.format(size))
+
+            begin = self._start + header_size
+            if self._end - begin < size:
+                break
+
+            result.append(bytes(self._buffer[begin:begin + size]))
+            self._start = begin + size
+
+        if self._start == self._end:
+            self.reset()
+            # a large frame grew the buffer, don't hold on to it once it has been drained
+            if len(self._buffer) > self._initial_size:
+                self._buffer = bytearray(self._initial_size)
+        return result
+
+    # private
+    def __reserve(self, size: int):
+        if len(self._buffer) - self._end >= size:
+            return
+
+        pending = self._end - self._start
+        if self._start:
+            # move the incomplete tail to the front before growing
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        if len(self._buffer) - self._end < size:
+            self._buffer.extend(bytearray(max(size, len(self._buffer))))
@@ -0,0 +1,207 @@
+import json
+import os
+import struct
+
+from gevent import select, socket
+from gevent.lock import BoundedSemaphore
+from gevent.event import AsyncResult
+from gevent.server import StreamServer
+
+from app.service.rpc import rpc_status
+
+
+class IpcError(Exception):
+    pass
+
+
+class IpcSendError(IpcError):
+    pass
+
+
+class IpcFrame(object):
+    HEADER = struct.Struct('>I')
+    MAX_SIZE = 64 * 1024 * 1024
+
+    @staticmethod
+    def send(sock, message: dict):
+        data = json.dumps(message, separators=(',', ':'), default=str).encode('utf-8')
+        sock.sendall(IpcFrame.HEADER.pack(len(data)) + data)
+
+    @staticmethod
+    def recv(sock) -> dict:
+        header = IpcFrame.__recv_exactly(sock, IpcFrame.HEADER.size)
+        if not header:
+            return None
+
+        size = IpcFrame.HEADER.unpack(header)[0]
+        if size > IpcFrame.MAX_SIZE:
+            raise IpcError('frame size {0} exceeds limit'.format(size))
+
+        data = IpcFrame.__recv_exactly(sock, size)
+        if data is None:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    # private
+    @staticmethod
+    def __recv_exactly(sock, size: int) -> bytes:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = sock.recv_into(view[received:])
+            if not count:
+                return None
+            received += count
+        return bytes(buffer)
+
+
+class IpcClient(object):
+    DEFAULT_POOL_SIZE = 8
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, path: str, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._limit = BoundedSemaphore(pool_size)
+        self._idle = []
+
+    def call(self, method: str, service=None, **params):
+        message = {'method': method, 'service': service, 'params': params}
+        with self._limit:
+            sock = self.__pooled()
+            if sock:
+                try:
+                    resp = self.__exchange(sock, method, message)
+                except IpcSendError as e:
+                    # the request never reached the daemon, so the retry can't run it twice
+                    print('Caught exception on pooled ipc connection, reconnecting: {0}'.format(e))
+                    resp = self.__exchange(self.__connect(), method, message)
+            else:
+                resp = self.__exchange(self.__connect(), method, message)
+
+        if 'error' in resp:
+            raise IpcError(resp['error'])
+        return resp.get('result')
+
+    # private
+    def __pooled(self):
+        # pooled sockets die silently when the daemon restarts; an idle socket that reads as ready was closed
+        while self._idle:
+            sock = self._idle.pop()
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return sock
+            sock.close()
+        return None
+
+    def __exchange(self, sock, method: str, message: dict) -> dict:
+        try:
+            IpcFrame.send(sock, message)
+        except OSError as e:
+            sock.close()
+            raise IpcSendError('ipc call {0} not sent: {1}'.format(method, e))
+
+        try:
+            resp = IpcFrame.recv(sock)
+        except (OSError, ValueError, IpcError) as e:
+            sock.close()
+            raise IpcError('ipc call {0} failed: {1}'.format(method, e))
+
+        if resp is None:
+            sock.close()
+            raise IpcError('ipc connection closed during {0}'.format(method))
+
+        self._idle.append(sock)
+        return resp
+
+    def __connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self._path)
+        except OSError as e:
+            sock.close()
+            raise IpcError('can\'t connect to {0}: {1}'.format(self._path, e))
+        return sock
+
+
+class IpcServer(object):
+    SERVICE_METHODS = {'connect', 'disconnect', 'activate', 'sync', 'stop', 'ping', 'get_log_service',
+                       'get_log_stream', 'get_pipeline_stream', 'start_stream', 'stop_stream', 'restart_stream',
+                       'control_streams', 'get_vods_in', 'get_service_timeseries', 'get_stream_timeseries',
+                       'get_streams_front', 'list_streams', 'refresh_streams', 'to_front'}
+    MANAGER_METHODS = {'loop_stats', 'connection_states', 'collect_metrics', 'attach_client', 'detach_client',
+                       'request_snapshot', 'client_stats', 'playlist_revision', 'playlist_invalidate',
+                       'playlist_invalidate_many', 'playlist_forget', 'reload_providers', 'reload_settings',
+                       'refresh_subscribers'}
+    RPC_WAIT_TIMEOUT = 5
+    SOCKET_MODE = 0o600
+
+    def __init__(self, path: str, manager):
+        self._path = path
+        self._manager = manager
+        if os.path.exists(path):
+            os.remove(path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # owner only from the start, chmod after bind would leave a window open
+        umask = os.umask(0o177)
+        try:
+            listener.bind(path)
+        finally:
+            os.umask(umask)
+        os.chmod(path, IpcServer.SOCKET_MODE)
+        listener.listen(128)
+        self._server = StreamServer(listener, self.__handle)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.stop()
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    # private
+    def __handle(self, sock, address):
+        while True:
+            try:
+                message = IpcFrame.recv(sock)
+            except (OSError, ValueError, IpcError) as e:
+                print('Caught exception while reading ipc frame: {0}'.format(e))
+                break
+
+            if message is None:
+                break
+
+            try:
+                resp = {'result': self.__dispatch(message)}
+            except Exception as e:
+                resp = {'error': '{0}: {1}'.format(type(e).__name__, e)}
+
+            try:
+                IpcFrame.send(sock, resp)
+            except OSError:
+                break
+        sock.close()
+
+    def __dispatch(self, message: dict):
+        method = message.get('method')
+        params = message.get('params') or {}
+        if method in IpcServer.MANAGER_METHODS:
+            return getattr(self._manager, method)(**params)
+
+        if method not in IpcServer.SERVICE_METHODS:
+            raise IpcError('unknown method: {0}'.format(method))
+
+        server = self._manager.find_or_create_server_by_id(message.get('service'))
+        if not server:
+            raise IpcError('service not found: {0}'.format(message.get('service')))
+        result = getattr(server, method)(**params)
+        if isinstance(result, AsyncResult):
+            # futures can't cross the socket, hand back their outcome instead
+            return rpc_status(result, IpcServer.RPC_WAIT_TIMEOUT)
+        return result
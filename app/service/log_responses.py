@@ -0,0 +1,51 @@
+from flask import Response, jsonify, send_file
+
+from app.service.log_store import LogStore
+
+
+def tail_response(store: LogStore, name: str, request) -> Response:
+    lines = min(request.args.get('lines', LogStore.DEFAULT_TAIL_LINES, type=int), LogStore.MAX_TAIL_LINES)
+    return Response(store.tail(name, lines), mimetype='text/plain')
+
+
+def range_response(store: LogStore, name: str, request):
+    total = store.size(name)
+    if request.range:
+        byte_range = request.range.range_for_length(total)
+        if not byte_range:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = 'bytes */{0}'.format(total)
+            return resp
+        start, stop = byte_range
+    else:
+        start = request.args.get('offset', 0, type=int)
+        length = request.args.get('length', LogStore.DEFAULT_RANGE_SIZE, type=int)
+        if start < 0 or length < 0:
+            return jsonify(status='failed', error='offset and length must not be negative'), 400
+        stop = min(start + length, total)
+
+    resp = Response(store.read_range(name, start, stop), mimetype='text/plain')
+    resp.headers['Accept-Ranges'] = 'bytes'
+    if request.range:
+        resp.status_code = 206
+        resp.headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, stop - 1, total)
+    return resp
+
+
+def search_response(store: LogStore, name: str, request):
+    pattern = request.args.get('q', '')
+    limit = min(request.args.get('limit', LogStore.DEFAULT_SEARCH_LIMIT, type=int), LogStore.MAX_SEARCH_LIMIT)
+    ignore_case = request.args.get('ignore_case', 0, type=int) != 0
+    matches = store.search(name, pattern.encode('utf-8'), limit, ignore_case)
+    return jsonify(status='ok', matches=[[line, text.decode('utf-8', errors='replace')] for line, text in matches])
+
+
+def download_response(store: LogStore, name: str, request) -> Response:
+    # the file is stored gzipped, clients that can't take it get it inflated chunk by chunk
+    if request.accept_encodings['gzip']:
+        resp = send_file(store.data_path(name), mimetype='text/plain', conditional=True)
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(store.iter_chunks(name), mimetype='text/plain')
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
@@ -0,0 +1,188 @@
+import bisect
+import gzip
+import json
+import mmap
+import os
+
+
+class LogTooLargeError(Exception):
+    pass
+
+
+class LogIndexEntry(object):
+    __slots__ = ['raw_offset', 'raw_size', 'offset', 'size', 'lines']
+
+    def __init__(self, raw_offset: int, raw_size: int, offset: int, size: int, lines: int):
+        self.raw_offset = raw_offset
+        self.raw_size = raw_size
+        self.offset = offset
+        self.size = size
+        self.lines = lines
+
+    def to_list(self) -> list:
+        return [self.raw_offset, self.raw_size, self.offset, self.size, self.lines]
+
+
+class LogStore(object):
+    CHUNK_SIZE = 64 * 1024
+    DEFAULT_TAIL_LINES = 1000
+    MAX_TAIL_LINES = 100000
+    DEFAULT_RANGE_SIZE = 1024 * 1024
+    DEFAULT_SEARCH_LIMIT = 100
+    MAX_SEARCH_LIMIT = 10000
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    COMPRESS_LEVEL = 6
+    DATA_EXTENSION = '.gz'
+    INDEX_EXTENSION = '.idx'
+
+    def __init__(self, folder: str, max_size=DEFAULT_MAX_SIZE):
+        self._folder = folder
+        self._max_size = max_size
+
+    def data_path(self, name: str) -> str:
+        return os.path.join(self._folder, name + LogStore.DATA_EXTENSION)
+
+    def index_path(self, name: str) -> str:
+        return os.path.join(self._folder, name + LogStore.INDEX_EXTENSION)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.data_path(name))
+
+    def ingest(self, name: str, stream, content_length=None) -> int:
+        if content_length and content_length > self._max_size:
+            raise LogTooLargeError('log size {0} exceeds limit {1}'.format(content_length, self._max_size))
+
+        data_path = self.data_path(name)
+        index_path = self.index_path(name)
+        tmp_data_path = data_path + '.tmp'
+        index = []
+        raw_offset = 0
+        offset = 0
+        try:
+            with open(tmp_data_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(LogStore.CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    if raw_offset + len(chunk) > self._max_size:
+                        raise LogTooLargeError('log size exceeds limit {0}'.format(self._max_size))
+
+                    member = gzip.compress(chunk, LogStore.COMPRESS_LEVEL)
+                    f.write(member)
+                    index.append(LogIndexEntry(raw_offset, len(chunk), offset, len(member), chunk.count(b'\n')))
+                    raw_offset += len(chunk)
+                    offset += len(member)
+
+            with open(index_path + '.tmp', 'w') as f:
+                json.dump([entry.to_list() for entry in index], f)
+        except BaseException:
+            LogStore.__remove_silent(tmp_data_path)
+            LogStore.__remove_silent(index_path + '.tmp')
+            raise
+
+        os.replace(tmp_data_path, data_path)
+        os.replace(index_path + '.tmp', index_path)
+        return raw_offset
+
+    def load_index(self, name: str) -> list:
+        with open(self.index_path(name), 'r') as f:
+            return [LogIndexEntry(*entry) for entry in json.load(f)]
+
+    def size(self, name: str) -> int:
+        index = self.load_index(name)
+        if not index:
+            return 0
+
+        last = index[-1]
+        return last.raw_offset + last.raw_size
+
+    def tail(self, name: str, lines: int) -> bytes:
+        index = self.load_index(name)
+        if not index or lines <= 0:
+            return b''
+
+        with open(self.data_path(name), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks = []
+            found = 0
+            for entry in reversed(index):
+                chunk = LogStore.__decompress(data, entry)
+                chunks.append(chunk)
+                # the last line of the log may have no trailing newline
+                found += entry.lines
+                if found > lines:
+                    break
+
+        content = b''.join(reversed(chunks))
+        if content.endswith(b'\n'):
+            content = content[:-1]
+        return b'\n'.join(content.split(b'\n')[-lines:])
+
+    def read_range(self, name: str, start: int, stop: int) -> bytes:
+        index = self.load_index(name)
+        if not index or start >= stop:
+            return b''
+
+        offsets = [entry.raw_offset for entry in index]
+        first = max(bisect.bisect_right(offsets, start) - 1, 0)
+        with open(self.data_path(name), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks = []
+            for entry in index[first:]:
+                if entry.raw_offset >= stop:
+                    break
+                chunks.append(LogStore.__decompress(data, entry))
+
+        content = b''.join(chunks)
+        base = index[first].raw_offset
+        return content[start - base:stop - base]
+
+    def search(self, name: str, pattern: bytes, limit: int, ignore_case=False) -> list:
+        index = self.load_index(name)
+        if not index or not pattern:
+            return []
+
+        if ignore_case:
+            pattern = pattern.lower()
+
+        matches = []
+        line_number = 0
+        remainder = b''
+        with open(self.data_path(name), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for entry in index:
+                lines = (remainder + LogStore.__decompress(data, entry)).split(b'\n')
+                remainder = lines.pop()
+                for line in lines:
+                    line_number += 1
+                    if LogStore.__match(line, pattern, ignore_case):
+                        matches.append((line_number, line))
+                        if len(matches) >= limit:
+                            return matches
+
+        if remainder and LogStore.__match(remainder, pattern, ignore_case):
+            matches.append((line_number + 1, remainder))
+        return matches
+
+    def iter_chunks(self, name: str):
+        index = self.load_index(name)
+        with open(self.data_path(name), 'rb') as f:
+            for entry in index:
+                f.seek(entry.offset)
+                yield gzip.decompress(f.read(entry.size))
+
+    # private
+    @staticmethod
+    def __decompress(data: mmap.mmap, entry: LogIndexEntry) -> bytes:
+        return gzip.decompress(data[entry.offset:entry.offset + entry.size])
+
+    @staticmethod
+    def __match(line: bytes, pattern: bytes, ignore_case: bool) -> bool:
+        if ignore_case:
+            line = line.lower()
+        return pattern in line
+
+    @staticmethod
+    def __remove_silent(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
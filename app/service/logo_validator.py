@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from gevent.threadpool import ThreadPool
+
+
+class LogoValidator(object):
+    DEFAULT_WORKERS = 16
+    DEFAULT_PER_HOST = 4
+    DEFAULT_TTL = 24 * 3600
+    DEFAULT_TIMEOUT = 2
+    MAX_CACHE_SIZE = 100000
+
+    def __init__(self, cache_path: str = None, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, ttl=DEFAULT_TTL,
+                 timeout=DEFAULT_TIMEOUT, checker=None):
+        self._cache_path = cache_path
+        self._checker = checker or LogoValidator.check_http_url
+        self._workers = workers
+        self._per_host = per_host
+        self._ttl = ttl
+        self._timeout = timeout
+        self._pool = None
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.__load_cache()
+
+    def validate(self, urls) -> dict:
+        result = {}
+        pending = []
+        now = time.time()
+        for url in set(urls):
+            valid = self.__get_cached(url, now)
+            if valid is None:
+                pending.append(url)
+            else:
+                result[url] = valid
+
+        if pending:
+            pending = LogoValidator.__interleave_hosts(pending)
+            for url, valid in zip(pending, self.__get_pool().map(self.__check, pending)):
+                result[url] = valid
+            self.__save_cache()
+
+        return result
+
+    def is_valid(self, url: str) -> bool:
+        return self.validate([url])[url]
+
+    @staticmethod
+    def check_http_url(url: str, timeout) -> bool:
+        # imported here so the validator can be used without the app package
+        from app.common.utils.utils import is_valid_http_url
+        return bool(is_valid_http_url(url, timeout=timeout))
+
+    # private
+    def __get_pool(self) -> ThreadPool:
+        if not self._pool:
+            self._pool = ThreadPool(self._workers)
+        return self._pool
+
+    def __get_host_limit(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            limit = self._hosts.get(host)
+            if not limit:
+                limit = threading.BoundedSemaphore(self._per_host)
+                self._hosts[host] = limit
+            return limit
+
+    def __check(self, url: str) -> bool:
+        with self.__get_host_limit(urlparse(url).netloc):
+            try:
+                valid = bool(self._checker(url, self._timeout))
+            except Exception:
+                valid = False
+
+        with self._lock:
+            self._cache[url] = (valid, time.time() + self._ttl)
+            self._cache.move_to_end(url)
+            while len(self._cache) > LogoValidator.MAX_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return valid
+
+    def __get_cached(self, url: str, now: float):
+        with self._lock:
+            entry = self._cache.get(url)
+            if not entry:
+                return None
+
+            valid, expires = entry
+            if expires < now:
+                del self._cache[url]
+                return None
+            return valid
+
+    def __load_cache(self):
+        if not self._cache_path or not os.path.exists(self._cache_path):
+            return
+
+        try:
+            with open(self._cache_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print('Caught exception while loading logo cache: {0}'.format(e))
+            return
+
+        now = time.time()
+        for url, valid, expires in entries:
+            if expires > now:
+                self._cache[url] = (valid, expires)
+
+    def __save_cache(self):
+        if not self._cache_path:
+            return
+
+        now = time.time()
+        with self._lock:
+            entries = [[url, valid, expires] for url, (valid, expires) in self._cache.items() if expires > now]
+
+        tmp_path = self._cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self._cache_path)
+        except OSError as e:
+            print('Caught exception while saving logo cache: {0}'.format(e))
+
+    @staticmethod
+    def __interleave_hosts(urls: list) -> list:
+        by_host = OrderedDict()
+        for url in urls:
+            by_host.setdefault(urlparse(url).netloc, []).append(url)
+
+        result = []
+        buckets = list(by_host.values())
+        while buckets:
+            for bucket in buckets:
+                result.append(bucket.pop())
+            buckets = [bucket for bucket in buckets if bucket]
+        return result
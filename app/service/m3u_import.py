@@ -0,0 +1,198 @@
+import os
+import time
+import uuid
+from itertools import islice
+
+import gevent
+
+import app.common.constants as constants
+from app.service.m3u_stream_parser import M3uStreamParser
+from app.service.stream_importer import ImportResult
+
+
+def make_stream_from_entry(server, stream_type, entry: dict, tags: list, default_logo_path: str):
+    if stream_type == constants.StreamType.PROXY:
+        stream = server.make_proxy_stream()
+    elif stream_type == constants.StreamType.RELAY:
+        stream = server.make_relay_stream()
+        stream.output.urls[0] = stream.generate_http_link()
+    elif stream_type == constants.StreamType.ENCODE:
+        stream = server.make_encode_stream()
+        stream.output.urls[0] = stream.generate_http_link()
+    elif stream_type == constants.StreamType.VOD_RELAY:
+        stream = server.make_vod_relay_stream()
+        stream.output.urls[0] = stream.generate_vod_link()
+    elif stream_type == constants.StreamType.VOD_ENCODE:
+        stream = server.make_vod_encode_stream()
+        stream.output.urls[0] = stream.generate_vod_link()
+    elif stream_type == constants.StreamType.COD_RELAY:
+        stream = server.make_cod_relay_stream()
+        stream.output.urls[0] = stream.generate_cod_link()
+    elif stream_type == constants.StreamType.COD_ENCODE:
+        stream = server.make_cod_encode_stream()
+        stream.output.urls[0] = stream.generate_cod_link()
+    elif stream_type == constants.StreamType.CATCHUP:
+        stream = server.make_catchup_stream()
+    else:
+        stream = server.make_test_life_stream()
+
+    input_url = entry['link']
+    if stream_type == constants.StreamType.PROXY:
+        stream.output.urls[0].uri = input_url
+    else:
+        stream.input.urls[0].uri = input_url
+
+    stream.tvg_logo = default_logo_path
+    stream.tags = tags
+
+    title = entry['title']
+    if len(title) < constants.MAX_STREAM_NAME_LENGTH:
+        stream.name = title
+
+    tvg_id = entry['tvg-id']
+    if len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
+        stream.tvg_id = tvg_id
+
+    tvg_name = entry['tvg-name']
+    if len(tvg_name) < constants.MAX_STREAM_NAME_LENGTH:
+        stream.tvg_name = tvg_name
+
+    tvg_group = entry['tvg-group']
+    if len(tvg_group) < constants.MAX_STREAM_GROUP_TITLE_LENGTH:
+        stream.group_title = tvg_group
+
+    return stream
+
+
+class M3uImportJob(object):
+    class State:
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    def __init__(self, path: str, server, stream_type, tags: list, default_logo_path: str):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.server = server
+        self.stream_type = stream_type
+        self.tags = tags
+        self.default_logo_path = default_logo_path
+        self.state = M3uImportJob.State.PENDING
+        self.processed = 0
+        self.result = ImportResult()
+        self.error = None
+        self.finished_at = 0.0
+
+    def is_finished(self) -> bool:
+        return self.state == M3uImportJob.State.DONE
+
+    def is_failed(self) -> bool:
+        return self.state == M3uImportJob.State.FAILED
+
+    def to_dict(self) -> dict:
+        progress = {'id': self.id, 'service': str(self.server.id), 'state': self.state, 'processed': self.processed,
+                    'error': self.error}
+        progress.update(self.result.to_dict())
+        return progress
+
+
+class M3uImportManager(object):
+    DEFAULT_CHUNK_SIZE = 500
+    MAX_FINISHED_JOBS = 100
+    FAILED_JOB_TTL = 24 * 3600
+
+    def __init__(self, folder: str, logo_validator, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._folder = folder
+        self._logo_validator = logo_validator
+        self._chunk_size = chunk_size
+        self._jobs = {}
+
+    def upload_path(self) -> str:
+        return os.path.join(self._folder, 'm3u_{0}'.format(uuid.uuid4().hex))
+
+    def start(self, path: str, server, stream_type, tags: list, default_logo_path: str) -> M3uImportJob:
+        self.__prune_finished()
+        job = M3uImportJob(path, server, stream_type, tags, default_logo_path)
+        self._jobs[job.id] = job
+        self.__spawn(job)
+        return job
+
+    def resume(self, jid: str) -> M3uImportJob:
+        job = self._jobs.get(jid)
+        if job and job.is_failed():
+            self.__spawn(job)
+        return job
+
+    def find_job(self, jid: str) -> M3uImportJob:
+        return self._jobs.get(jid)
+
+    def get_jobs(self, server) -> list:
+        self.__prune_finished()
+        return [job for job in self._jobs.values() if job.server.id == server.id]
+
+    # private
+    def __prune_finished(self):
+        finished = [jid for jid, job in self._jobs.items() if job.is_finished()]
+        for jid in finished[:max(0, len(finished) - M3uImportManager.MAX_FINISHED_JOBS)]:
+            del self._jobs[jid]
+
+        # failed jobs keep their spool file for resume, until nobody came back for them
+        expired = time.time() - M3uImportManager.FAILED_JOB_TTL
+        for jid, job in list(self._jobs.items()):
+            if job.is_failed() and job.finished_at < expired:
+                del self._jobs[jid]
+                M3uImportManager.__remove_file(job.path)
+
+    def __spawn(self, job: M3uImportJob):
+        job.state = M3uImportJob.State.RUNNING
+        job.error = None
+        gevent.spawn(self.__run, job)
+
+    def __run(self, job: M3uImportJob):
+        parser = M3uStreamParser()
+        try:
+            with open(job.path, 'rb') as f:
+                entries = islice(parser.parse(f), job.processed, None)
+                while True:
+                    chunk = list(islice(entries, self._chunk_size))
+                    if not chunk:
+                        break
+
+                    job.result.merge(self.__import_chunk(job, chunk))
+                    job.processed += len(chunk)
+                    gevent.sleep(0)
+        except Exception as e:
+            print('Caught exception while importing {0}: {1}'.format(job.path, e))
+            job.state = M3uImportJob.State.FAILED
+            job.error = str(e)
+            job.finished_at = time.time()
+            return
+
+        job.state = M3uImportJob.State.DONE
+        job.finished_at = time.time()
+        M3uImportManager.__remove_file(job.path)
+
+    def __import_chunk(self, job: M3uImportJob, chunk: list) -> ImportResult:
+        streams = []
+        logos = []
+        for entry in chunk:
+            stream = make_stream_from_entry(job.server, job.stream_type, entry, job.tags, job.default_logo_path)
+            tvg_logo = entry['tvg-logo']
+            if tvg_logo and len(tvg_logo) < constants.MAX_URL_LENGTH:
+                logos.append((stream, tvg_logo))
+            streams.append(stream)
+
+        valid_logos = self._logo_validator.validate([tvg_logo for _, tvg_logo in logos])
+        for stream, tvg_logo in logos:
+            if valid_logos[tvg_logo]:
+                stream.tvg_logo = tvg_logo
+
+        return job.server.import_streams(streams)
+
+    @staticmethod
+    def __remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,35 @@
+import re
+
+
+class M3uStreamParser(object):
+    EXTINF_TAG = '#EXTINF:'
+    ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)="([^"]*)"')
+
+    def __init__(self, encoding='utf-8'):
+        self._encoding = encoding
+
+    def parse(self, lines):
+        info = None
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode(self._encoding, errors='replace')
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith(M3uStreamParser.EXTINF_TAG):
+                info = M3uStreamParser.__parse_extinf(line)
+            elif line.startswith('#'):
+                continue
+            elif info is not None:
+                info['link'] = line
+                yield info
+                info = None
+
+    # private
+    @staticmethod
+    def __parse_extinf(line: str) -> dict:
+        meta, _, title = line[len(M3uStreamParser.EXTINF_TAG):].partition(',')
+        attrs = dict(M3uStreamParser.ATTRIBUTE_PATTERN.findall(meta))
+        return {'title': title.strip(), 'tvg-id': attrs.get('tvg-id', ''), 'tvg-name': attrs.get('tvg-name', ''),
+                'tvg-logo': attrs.get('tvg-logo', ''), 'tvg-group': attrs.get('group-title', '')}
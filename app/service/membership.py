@@ -0,0 +1,64 @@
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+
+from app.common.service.entry import ServiceSettings, ProviderPair
+from app.common.subscriber.entry import Subscriber
+from app.home.entry import ProviderUser, user_cache
+
+
+class Membership(object):
+    # every change is a fixed number of single document or multi document updates, no load-modify-save of the
+    # member lists; raw updates skip the save signals so the user cache is invalidated here
+    INDEXES = [(ServiceSettings, 'providers.user'), (ServiceSettings, 'subscribers'), (ProviderUser, 'servers'),
+               (Subscriber, 'servers')]
+
+    @staticmethod
+    def ensure_indexes():
+        for document, field in Membership.INDEXES:
+            try:
+                document._get_collection().create_index(field, background=True)
+            except PyMongoError as e:
+                print('Caught exception while creating index {0}: {1}'.format(field, e))
+
+    @staticmethod
+    def add_provider(server_id: ObjectId, provider_id: ObjectId, role: ProviderPair.Roles):
+        pushed = ServiceSettings.objects(id=server_id, providers__user__ne=provider_id).update_one(
+            push__providers=ProviderPair(provider_id, role))
+        if not pushed:
+            ServiceSettings.objects(id=server_id, providers__user=provider_id).update_one(
+                set__providers__S__role=role)
+        ProviderUser.objects(id=provider_id).update_one(add_to_set__servers=server_id)
+        user_cache.invalidate(provider_id)
+        user_cache.invalidate_server(server_id)
+
+    @staticmethod
+    def remove_provider(server_id: ObjectId, provider_id: ObjectId):
+        ServiceSettings.objects(id=server_id).update_one(pull__providers__user=provider_id)
+        ProviderUser.objects(id=provider_id).update_one(pull__servers=server_id)
+        user_cache.invalidate(provider_id)
+        user_cache.invalidate_server(server_id)
+
+    @staticmethod
+    def remove_provider_everywhere(provider_id: ObjectId) -> list:
+        server_ids = list(ServiceSettings.objects(providers__user=provider_id).scalar('id'))
+        if server_ids:
+            ServiceSettings.objects(id__in=server_ids).update(pull__providers__user=provider_id)
+        user_cache.invalidate(provider_id)
+        for server_id in server_ids:
+            user_cache.invalidate_server(server_id)
+        return server_ids
+
+    @staticmethod
+    def add_subscriber(server_id: ObjectId, subscriber_id: ObjectId):
+        Subscriber.objects(id=subscriber_id).update_one(add_to_set__servers=server_id)
+        ServiceSettings.objects(id=server_id).update_one(add_to_set__subscribers=subscriber_id)
+        user_cache.invalidate_server(server_id)
+
+    @staticmethod
+    def remove_subscriber_everywhere(subscriber_id: ObjectId) -> list:
+        server_ids = list(ServiceSettings.objects(subscribers=subscriber_id).scalar('id'))
+        if server_ids:
+            ServiceSettings.objects(id__in=server_ids).update(pull__subscribers=subscriber_id)
+        for server_id in server_ids:
+            user_cache.invalidate_server(server_id)
+        return server_ids
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import itertools
+from collections import OrderedDict
+
+from flask import Response
+
+
+class PlaylistEntry(object):
+    __slots__ = ['body', 'gzip_body', 'etag']
+
+    def __init__(self, content: str):
+        self.body = content.encode('utf-8')
+        self.gzip_body = gzip.compress(self.body)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+class PlaylistCache(object):
+    MIMETYPE = 'application/x-mpequrl'
+    DEFAULT_MAX_ENTRIES = 10000
+
+    @staticmethod
+    def service_key(sid) -> str:
+        return 'service_{0}'.format(sid)
+
+    @staticmethod
+    def stream_key(sid) -> str:
+        return 'stream_{0}'.format(sid)
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        # revisions come from one counter, so a key that was forgotten never gets an old revision back
+        self._counter = itertools.count(1)
+        self._floor = 0
+        self._revisions = {}
+        self._entries = OrderedDict()
+
+    def revision(self, key: str) -> int:
+        return self._revisions.get(key, self._floor)
+
+    def invalidate(self, key: str):
+        self._revisions[key] = next(self._counter)
+        self._entries.pop(key, None)
+
+    def invalidate_many(self, keys: list):
+        for key in keys:
+            self.invalidate(key)
+
+    def forget(self, keys: list):
+        # entries cached by other processes at the old floor must not match a forgotten key
+        self._floor = next(self._counter)
+        for key in keys:
+            self._revisions.pop(key, None)
+            self._entries.pop(key, None)
+
+    def get(self, key: str) -> PlaylistEntry:
+        cached = self._entries.get(key)
+        if not cached:
+            return None
+
+        revision, entry = cached
+        if revision != self.revision(key):
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_generate(self, key: str, generate) -> PlaylistEntry:
+        entry = self.get(key)
+        if entry:
+            return entry
+
+        revision = self.revision(key)
+        content = generate()
+        if content is None:
+            return None
+
+        entry = PlaylistEntry(content)
+        if revision == self.revision(key):
+            self.__store(key, revision, entry)
+        return entry
+
+    @staticmethod
+    def make_response(entry: PlaylistEntry, request) -> Response:
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        etag = entry.etag + '-gz' if use_gzip else entry.etag
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(entry.gzip_body if use_gzip else entry.body, mimetype=PlaylistCache.MIMETYPE)
+            if use_gzip:
+                resp.headers['Content-Encoding'] = 'gzip'
+
+        resp.set_etag(etag)
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+
+    # private
+    def __store(self, key: str, revision: int, entry: PlaylistEntry):
+        self._entries[key] = (revision, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            # no entry left for it here, the next one is generated against the floor
+            self._revisions.pop(evicted, None)
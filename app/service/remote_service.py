@@ -0,0 +1,245 @@
+from pyfastocloud.client_constants import ClientStatus
+
+from app.common.service.entry import ServiceSettings
+from app.common.stream.entry import IStream
+from app.service.ipc import IpcClient
+from app.service.playlist_cache import PlaylistCache
+from app.service.service import BaseService, ServiceFields
+from app.service.stream_importer import StreamImporter, ImportResult
+from app.service.timeseries import Resolution
+from app.service.stream_listing import StreamListing
+
+
+class RemoteService(BaseService):
+    def __init__(self, client: IpcClient, settings: ServiceSettings):
+        super(RemoteService, self).__init__(settings)
+        self._client = client
+        self._front = None
+
+    def connect(self):
+        return self.__call('connect')
+
+    def disconnect(self):
+        return self.__call('disconnect')
+
+    def stop(self, delay: int):
+        return self.__call('stop', delay=delay)
+
+    def get_log_service(self):
+        return self.__call('get_log_service')
+
+    def ping(self):
+        return self.__call('ping')
+
+    def activate(self, license_key: str):
+        return self.__call('activate', license_key=license_key)
+
+    def sync(self, prepare=False, full=False):
+        return self.__call('sync', prepare=prepare, full=full)
+
+    def get_log_stream(self, sid: str):
+        return self.__call('get_log_stream', sid=sid)
+
+    def get_pipeline_stream(self, sid: str):
+        return self.__call('get_pipeline_stream', sid=sid)
+
+    def start_stream(self, sid: str):
+        return self.__call('start_stream', sid=sid)
+
+    def stop_stream(self, sid: str):
+        return self.__call('stop_stream', sid=sid)
+
+    def restart_stream(self, sid: str):
+        return self.__call('restart_stream', sid=sid)
+
+    def control_streams(self, command: str, sids: list) -> dict:
+        return self.__call('control_streams', command=command, sids=sids)
+
+    def get_service_timeseries(self, metric: str, resolution=Resolution.RAW, since=0) -> list:
+        return self.__call('get_service_timeseries', metric=metric, resolution=resolution, since=since)
+
+    def get_stream_timeseries(self, sid: str, metric: str, resolution=Resolution.RAW, since=0) -> list:
+        return self.__call('get_stream_timeseries', sid=sid, metric=metric, resolution=resolution, since=since)
+
+    def get_vods_in(self) -> list:
+        return self.__call('get_vods_in')
+
+    def get_streams_front(self) -> list:
+        return self.__call('get_streams_front')
+
+    def list_streams(self, kind=None, sort='name', order='asc', name=None, tag=None, group=None, cursor=None,
+                     limit=StreamListing.DEFAULT_LIMIT) -> dict:
+        return self.__call('list_streams', kind=kind, sort=sort, order=order, name=name, tag=tag, group=group,
+                           cursor=cursor, limit=limit)
+
+    def to_front(self) -> dict:
+        if self._front is None:
+            self._front = self.__call('to_front')
+        return self._front
+
+    @property
+    def status(self) -> ClientStatus:
+        return ClientStatus(self.to_front()[ServiceFields.STATUS])
+
+    @property
+    def cpu(self):
+        return self.to_front()[ServiceFields.CPU]
+
+    @property
+    def gpu(self):
+        return self.to_front()[ServiceFields.GPU]
+
+    @property
+    def load_average(self):
+        return self.to_front()[ServiceFields.LOAD_AVERAGE]
+
+    @property
+    def memory_total(self):
+        return self.to_front()[ServiceFields.MEMORY_TOTAL]
+
+    @property
+    def memory_free(self):
+        return self.to_front()[ServiceFields.MEMORY_FREE]
+
+    @property
+    def hdd_total(self):
+        return self.to_front()[ServiceFields.HDD_TOTAL]
+
+    @property
+    def hdd_free(self):
+        return self.to_front()[ServiceFields.HDD_FREE]
+
+    @property
+    def bandwidth_in(self):
+        return self.to_front()[ServiceFields.BANDWIDTH_IN]
+
+    @property
+    def bandwidth_out(self):
+        return self.to_front()[ServiceFields.BANDWIDTH_OUT]
+
+    @property
+    def uptime(self):
+        return self.to_front()[ServiceFields.UPTIME]
+
+    @property
+    def timestamp(self):
+        return self.to_front()[ServiceFields.TIMESTAMP]
+
+    @property
+    def version(self) -> str:
+        return self.to_front()[ServiceFields.VERSION]
+
+    @property
+    def os(self) -> str:
+        return self.to_front()[ServiceFields.OS]
+
+    @property
+    def online_users(self) -> str:
+        return self.to_front()[ServiceFields.ONLINE_USERS]
+
+    def find_stream_by_id(self, sid: str):
+        if not ServiceSettings.objects(id=self.id, streams=sid).count():
+            return None
+
+        stream = IStream.objects(id=sid).first()
+        if stream:
+            stream.set_server_settings(self._settings)
+        return stream
+
+    def add_stream(self, stream):
+        self.add_streams([stream])
+
+    def add_streams(self, streams):
+        for stream in streams:
+            self._settings.streams.append(stream)
+        self._settings.save()
+        self.__refresh_streams(added=[stream.id for stream in streams])
+
+    def import_streams(self, streams: list) -> ImportResult:
+        result, inserted = StreamImporter(self._settings).insert(streams)
+        if inserted:
+            self.__refresh_streams(added=[stream.id for stream in inserted])
+        return result
+
+    def update_stream(self, stream):
+        stream.save()
+        self.__refresh_streams(updated=[stream.id])
+
+    def remove_stream(self, sid: str):
+        self.__refresh_streams(removed=[sid])
+
+    # private
+    def __refresh_streams(self, added=None, updated=None, removed=None):
+        self.__call('refresh_streams', added=[str(sid) for sid in added or []],
+                    updated=[str(sid) for sid in updated or []], removed=[str(sid) for sid in removed or []])
+
+    def __call(self, method: str, **params):
+        return self._client.call(method, str(self.id), **params)
+
+
+class RemoteServiceManager(object):
+    def __init__(self, client: IpcClient):
+        self._client = client
+
+    def find_or_create_server(self, settings: ServiceSettings) -> RemoteService:
+        return RemoteService(self._client, settings)
+
+    def reload_providers(self, sid):
+        self._client.call('reload_providers', sid=str(sid))
+
+    def reload_settings(self, sid):
+        self._client.call('reload_settings', sid=str(sid))
+
+    def refresh_subscribers(self, sid, added=None, removed=None):
+        self._client.call('refresh_subscribers', sid=str(sid), added=[str(uid) for uid in added or []],
+                          removed=[str(uid) for uid in removed or []])
+
+    def attach_client(self, client_sid: str, room: str):
+        self._client.call('attach_client', client_sid=client_sid, room=room)
+
+    def detach_client(self, client_sid: str):
+        self._client.call('detach_client', client_sid=client_sid)
+
+    def request_snapshot(self, client_sid: str):
+        self._client.call('request_snapshot', client_sid=client_sid)
+
+    def client_stats(self) -> dict:
+        return self._client.call('client_stats')
+
+    def loop_stats(self) -> dict:
+        return self._client.call('loop_stats')
+
+    def connect_all(self):
+        pass
+
+    def connection_states(self) -> dict:
+        return self._client.call('connection_states')
+
+    def collect_metrics(self) -> list:
+        return self._client.call('collect_metrics')
+
+    def refresh(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class RemotePlaylistCache(PlaylistCache):
+    def __init__(self, client: IpcClient, max_entries=PlaylistCache.DEFAULT_MAX_ENTRIES):
+        super(RemotePlaylistCache, self).__init__(max_entries)
+        self._client = client
+
+    def revision(self, key: str) -> int:
+        return self._client.call('playlist_revision', key=key)
+
+    def invalidate(self, key: str):
+        self._client.call('playlist_invalidate', key=key)
+
+    def invalidate_many(self, keys: list):
+        self._client.call('playlist_invalidate_many', keys=keys)
+
+    def forget(self, keys: list):
+        for key in keys:
+            self._entries.pop(key, None)
+        self._client.call('playlist_forget', keys=keys)
@@ -0,0 +1,107 @@
+import time
+
+import gevent
+from gevent.event import AsyncResult
+
+from app.metrics.metrics import RPC_LATENCY, RPC_TIMEOUTS, RPC_CANCELLED
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcTimeoutError(RpcError):
+    pass
+
+
+class RpcCancelledError(RpcError):
+    pass
+
+
+class PendingRequest(object):
+    __slots__ = ['method', 'result', 'sent', 'deadline']
+
+    def __init__(self, method: str, timeout: float):
+        self.method = method
+        self.result = AsyncResult()
+        self.sent = time.monotonic()
+        self.deadline = self.sent + timeout
+
+
+class PendingRequests(object):
+    DEFAULT_TIMEOUT = 30
+    SWEEP_INTERVAL = 1
+
+    def __init__(self, service_id, default_timeout=DEFAULT_TIMEOUT):
+        self._service_id = service_id
+        self._default_timeout = default_timeout
+        self._pending = {}
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def track(self, request_id, method: str, timeout=None) -> AsyncResult:
+        request = PendingRequest(method, timeout or self._default_timeout)
+        self._pending[str(request_id)] = request
+        if not self._sweeper:
+            self._sweeper = gevent.spawn(self.__sweep)
+        return request.result
+
+    def resolve(self, request_id, resp) -> bool:
+        request = self._pending.pop(str(request_id), None)
+        if not request:
+            return False
+
+        RPC_LATENCY.observe(time.monotonic() - request.sent, request.method)
+        request.result.set(resp)
+        return True
+
+    # the caller gave up waiting, for the node it is the same as a missed deadline
+    def cancel(self, result: AsyncResult):
+        for request_id, request in list(self._pending.items()):
+            if request.result is result:
+                del self._pending[request_id]
+                RPC_TIMEOUTS.inc(self._service_id, request.method)
+                request.result.set_exception(RpcTimeoutError('{0} timed out'.format(request.method)))
+                break
+
+    def cancel_all(self, reason: str):
+        pending, self._pending = self._pending, {}
+        for request in pending.values():
+            RPC_CANCELLED.inc(self._service_id, request.method)
+            request.result.set_exception(RpcCancelledError(reason))
+
+    def expire(self):
+        now = time.monotonic()
+        for request_id, request in list(self._pending.items()):
+            if request.deadline <= now:
+                del self._pending[request_id]
+                RPC_TIMEOUTS.inc(self._service_id, request.method)
+                request.result.set_exception(RpcTimeoutError('{0} timed out'.format(request.method)))
+
+    # private
+    def __sweep(self):
+        while self._pending:
+            gevent.sleep(PendingRequests.SWEEP_INTERVAL)
+            self.expire()
+        self._sweeper = None
+
+
+def rpc_status(result, timeout=None) -> dict:
+    # result is an AsyncResult from a local service or an already resolved dict from a remote one
+    if isinstance(result, dict):
+        return result
+    if result is None:
+        return {'status': 'failed', 'error': 'not sent'}
+
+    try:
+        resp = result.get(timeout=timeout)
+    except gevent.Timeout:
+        return {'status': 'failed', 'error': 'timeout'}
+    except RpcError as e:
+        return {'status': 'failed', 'error': str(e)}
+
+    if resp.is_message():
+        return {'status': 'ok'}
+    return {'status': 'failed', 'error': str(resp.error)}
@@ -1,3 +1,6 @@
+import re
+
+import gevent
 from bson.objectid import ObjectId
 
 from app.common.stream.entry import IStream, ProxyStream, EncodeStream, RelayStream, TimeshiftRecorderStream, \
@@ -6,8 +9,17 @@ from app.common.stream.entry import IStream, ProxyStream, EncodeStream, RelayStr
 from pyfastocloud.client_constants import ClientStatus
 
 from app.common.service.entry import ServiceSettings, ProviderPair
+from app.common.subscriber.entry import Subscriber
 from app.service.service_client import ServiceClient, OperationSystem
 from app.service.stream_handler import IStreamHandler
+from app.service.service_handler import IServiceHandler
+from app.service.emitter import CoalescingEmitter
+from app.service.stream_importer import StreamImporter, ImportResult
+from app.service.timeseries import TimeSeriesStore, Resolution
+from app.service.stream_listing import StreamListing
+from app.service.stream_runtime import StreamRuntimeTable
+from app.metrics.metrics import FRONT_UPDATES
+from app.service.rpc import rpc_status
 
 
 class OnlineUsers(object):
@@ -45,12 +57,168 @@ class ServiceFields:
     OS = 'os'
 
 
-class Service(IStreamHandler):
+class StreamRecord(object):
+    # what the loop needs of a stream between config changes, the document itself is loaded on demand
+    __slots__ = ['id', 'name', 'tvg_id', 'tags', 'group_title', 'type', 'front']
+
+    def __init__(self, stream: IStream):
+        self.id = stream.id
+        self.name = stream.name
+        self.tvg_id = stream.tvg_id
+        self.tags = list(stream.tags or [])
+        self.group_title = stream.group_title
+        self.type = stream.get_type()
+        self.front = stream.to_front()
+
+    def get_type(self):
+        return self.type
+
+
+class StreamsRegistry(object):
+    __slots__ = ['_by_id', '_by_name', '_by_tvg_id', '_keys']
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_name = {}
+        self._by_tvg_id = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __contains__(self, sid):
+        return str(sid) in self._by_id
+
+    def add(self, stream: StreamRecord):
+        sid = str(stream.id)
+        if sid in self._by_id:
+            self.__unindex(sid)
+        self._by_id[sid] = stream
+        self.__index(sid, stream)
+
+    def remove(self, sid) -> StreamRecord:
+        sid = str(sid)
+        stream = self._by_id.pop(sid, None)
+        if stream:
+            self.__unindex(sid)
+        return stream
+
+    def clear(self):
+        self._by_id.clear()
+        self._by_name.clear()
+        self._by_tvg_id.clear()
+        self._keys.clear()
+
+    def find_by_id(self, sid) -> StreamRecord:
+        return self._by_id.get(str(sid))
+
+    def find_by_name(self, name: str) -> list:
+        return list(self._by_name.get(name, {}).values())
+
+    def find_by_tvg_id(self, tvg_id: str) -> list:
+        return list(self._by_tvg_id.get(tvg_id, {}).values())
+
+    # private
+    def __index(self, sid: str, stream: StreamRecord):
+        name = stream.name
+        tvg_id = stream.tvg_id
+        self._keys[sid] = (name, tvg_id)
+        self._by_name.setdefault(name, {})[sid] = stream
+        if tvg_id:
+            self._by_tvg_id.setdefault(tvg_id, {})[sid] = stream
+
+    def __unindex(self, sid: str):
+        name, tvg_id = self._keys.pop(sid, (None, None))
+        StreamsRegistry.__discard(self._by_name, name, sid)
+        StreamsRegistry.__discard(self._by_tvg_id, tvg_id, sid)
+
+    @staticmethod
+    def __discard(index: dict, key, sid: str):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+
+        bucket.pop(sid, None)
+        if not bucket:
+            del index[key]
+
+
+class StreamControl:
+    START = 'start'
+    STOP = 'stop'
+    RESTART = 'restart'
+
+
+class BaseService(object):
+    def __init__(self, settings: ServiceSettings):
+        self._settings = settings
+
+    @property
+    def id(self) -> ObjectId:
+        return self._settings.id
+
+    @property
+    def room(self) -> str:
+        return str(self.id)
+
+    def get_user_role_by_id(self, uid: ObjectId) -> ProviderPair.Roles:
+        for user in self._settings.providers:
+            if user.user.id == uid:
+                return user.role
+
+        return ProviderPair.Roles.READ
+
+    def make_proxy_stream(self) -> ProxyStream:
+        return ProxyStream.make_stream(self._settings)
+
+    def make_relay_stream(self) -> RelayStream:
+        return RelayStream.make_stream(self._settings)
+
+    def make_vod_relay_stream(self) -> VodRelayStream:
+        return VodRelayStream.make_stream(self._settings)
+
+    def make_cod_relay_stream(self) -> CodRelayStream:
+        return CodRelayStream.make_stream(self._settings)
+
+    def make_encode_stream(self) -> EncodeStream:
+        return EncodeStream.make_stream(self._settings)
+
+    def make_vod_encode_stream(self) -> VodEncodeStream:
+        return VodEncodeStream.make_stream(self._settings)
+
+    def make_cod_encode_stream(self) -> CodEncodeStream:
+        return CodEncodeStream.make_stream(self._settings)
+
+    def make_timeshift_recorder_stream(self) -> TimeshiftRecorderStream:
+        return TimeshiftRecorderStream.make_stream(self._settings)
+
+    def make_catchup_stream(self) -> CatchupStream:
+        return CatchupStream.make_stream(self._settings)
+
+    def make_timeshift_player_stream(self) -> TimeshiftPlayerStream:
+        return TimeshiftPlayerStream.make_stream(self._settings)
+
+    def make_test_life_stream(self) -> TestLifeStream:
+        return TestLifeStream.make_stream(self._settings)
+
+
+class Service(BaseService, IStreamHandler):
     SERVER_ID = 'server_id'
     STREAM_DATA_CHANGED = 'stream_data_changed'
     SERVICE_DATA_CHANGED = 'service_data_changed'
     INIT_VALUE = 0
     CALCULATE_VALUE = None
+    CONTROL_TIMEOUT = 5
+    SERVICE_TIMESERIES_METRICS = [ServiceFields.CPU, ServiceFields.GPU, ServiceFields.LOAD_AVERAGE,
+                                  ServiceFields.MEMORY_FREE, ServiceFields.HDD_FREE, ServiceFields.BANDWIDTH_IN,
+                                  ServiceFields.BANDWIDTH_OUT]
+    STREAM_TIMESERIES_METRICS = ['cpu', 'rss', 'restarts', 'input_bps', 'output_bps']
+    # streams are left out, only their ids are read so the documents aren't kept by the settings
+    SETTINGS_RELOAD_FIELDS = [name for name in ServiceSettings._fields if name not in ('id', 'streams')]
+    RUNTIME_SORT_COLUMNS = {'bps': StreamRuntimeTable.INPUT_BPS, 'out_bps': StreamRuntimeTable.OUTPUT_BPS}
 
     # runtime
     _cpu = INIT_VALUE
@@ -64,27 +232,50 @@ class Service(IStreamHandler):
     _bandwidth_out = INIT_VALUE
     _uptime = CALCULATE_VALUE
     _timestamp = CALCULATE_VALUE
-    _streams = []
     _online_users = None
     _os = OperationSystem()
 
-    def __init__(self, host, port, socketio, settings: ServiceSettings):
-        self._settings = settings
+    def __init__(self, host, port, emitter: CoalescingEmitter, settings: ServiceSettings,
+                 handler: IServiceHandler = None):
+        super(Service, self).__init__(settings)
+        self._handler = handler
+        self._streams = StreamsRegistry()
+        self._runtime = StreamRuntimeTable()
+        self._timeseries = TimeSeriesStore(Service.STREAM_TIMESERIES_METRICS, TimeSeriesStore.STREAM_SIZES)
+        self._service_timeseries = TimeSeriesStore(Service.SERVICE_TIMESERIES_METRICS, TimeSeriesStore.SERVICE_SIZES)
         self.__reload_from_db()
         # other fields
         self._client = ServiceClient(settings.id, settings.host.host, settings.host.port, self)
+        self._keep_connected = False
         self._host = host
         self._port = port
-        self._socketio = socketio
+        self._emitter = emitter
+
+    @property
+    def keep_connected(self) -> bool:
+        return self._keep_connected
 
     def connect(self):
-        return self._client.connect()
+        self._keep_connected = True
+        result = self._client.connect()
+        self.__notify_connection_changed()
+        return result
 
     def is_connected(self):
         return self._client.is_connected()
 
     def disconnect(self):
-        return self._client.disconnect()
+        self._keep_connected = False
+        result = self._client.disconnect()
+        self.__notify_connection_changed()
+        return result
+
+    def drop_connection(self):
+        # unlike disconnect this keeps reconnecting enabled
+        try:
+            self._client.disconnect()
+        except OSError as e:
+            print('Caught exception while dropping service connection: {0}'.format(e))
 
     def socket(self):
         return self._client.socket()
@@ -104,36 +295,88 @@ class Service(IStreamHandler):
     def activate(self, license_key: str):
         return self._client.activate(license_key)
 
-    def sync(self, prepare=False):
-        settings = self._settings.reload()
+    def sync(self, prepare=False, full=False):
+        if not full and not self._client.needs_full_sync():
+            # configs changed since the last sync are tracked by the mutators, nothing to reload
+            return self._client.sync_service(None, False)
+
+        settings = self.__reload_settings()
         if prepare:
             self._client.prepare_service(settings)
-        return self._client.sync_service(settings)
+        return self._client.sync_service(settings, True, self.__iter_streams())
+
+    def reload_providers(self):
+        self._settings.reload('providers')
+
+    def reload_settings(self):
+        # hosts and directories go into every stream config, the next sync resends all of them
+        self.__reload_settings()
+        self.__reload_from_db()
+        self._client.request_full_sync()
 
     def get_log_stream(self, sid: str):
         stream = self.find_stream_by_id(sid)
         if stream:
-            self._client.get_log_stream(self._host, self._port, sid, stream.generate_feedback_dir())
+            return self._client.get_log_stream(self._host, self._port, sid, stream.generate_feedback_dir())
 
     def get_pipeline_stream(self, sid):
         stream = self.find_stream_by_id(sid)
         if stream:
-            self._client.get_pipeline_stream(self._host, self._port, sid, stream.generate_feedback_dir())
+            return self._client.get_pipeline_stream(self._host, self._port, sid, stream.generate_feedback_dir())
 
     def start_stream(self, sid: str):
         stream = self.find_stream_by_id(sid)
         if stream:
-            self._client.start_stream(stream.config())
+            return self._client.start_stream(stream.config())
 
     def stop_stream(self, sid: str):
-        stream = self.find_stream_by_id(sid)
-        if stream:
-            self._client.stop_stream(sid)
+        if sid in self._streams:
+            return self._client.stop_stream(sid)
 
     def restart_stream(self, sid: str):
-        stream = self.find_stream_by_id(sid)
-        if stream:
-            self._client.restart_stream(sid)
+        if sid in self._streams:
+            return self._client.restart_stream(sid)
+
+    def control_streams(self, command: str, sids: list, timeout=CONTROL_TIMEOUT) -> dict:
+        results = {}
+        if not self.is_connected():
+            for sid in sids:
+                results[sid] = {'status': 'failed', 'error': 'not connected'}
+            return results
+
+        configs = {}
+        if command == StreamControl.START:
+            # one query for all the documents, only starting needs the full config
+            known = [sid for sid in sids if sid in self._streams]
+            for stream in IStream.objects(id__in=known):
+                stream.set_server_settings(self._settings)
+                configs[str(stream.id)] = stream.config()
+
+        pending = {}
+        for sid in sids:
+            if sid not in self._streams or (command == StreamControl.START and str(sid) not in configs):
+                results[sid] = {'status': 'failed', 'error': 'not found'}
+                continue
+
+            if command == StreamControl.START:
+                pending[sid] = self._client.start_stream(configs[str(sid)])
+            elif command == StreamControl.STOP:
+                pending[sid] = self._client.stop_stream(sid)
+            else:
+                pending[sid] = self._client.restart_stream(sid)
+
+        gevent.wait(list(pending.values()), timeout=timeout)
+        for sid, result in pending.items():
+            if not result.ready():
+                self._client.cancel_request(result)
+            results[sid] = rpc_status(result, 0)
+        return results
+
+    def get_service_timeseries(self, metric: str, resolution=Resolution.RAW, since=0) -> list:
+        return self._service_timeseries.window(self.room, metric, resolution, since)
+
+    def get_stream_timeseries(self, sid: str, metric: str, resolution=Resolution.RAW, since=0) -> list:
+        return self._timeseries.window(sid, metric, resolution, since)
 
     def get_vods_in(self) -> list:
         return self._client.get_vods_in()
@@ -142,10 +385,6 @@ class Service(IStreamHandler):
     def host(self) -> str:
         return self._host
 
-    @property
-    def id(self) -> ObjectId:
-        return self._settings.id
-
     @property
     def status(self) -> ClientStatus:
         return self._client.status()
@@ -209,42 +448,84 @@ class Service(IStreamHandler):
     def get_streams(self):
         return self._streams
 
+    def get_streams_front(self) -> list:
+        return [self.stream_front(stream) for stream in self._streams]
+
+    def stream_front(self, stream: StreamRecord) -> dict:
+        front = dict(stream.front)
+        row = self._runtime.row(stream.id)
+        if row:
+            front.update(row.to_front())
+        return front
+
+    def list_streams(self, kind=None, sort='name', order='asc', name=None, tag=None, group=None, cursor=None,
+                     limit=StreamListing.DEFAULT_LIMIT) -> dict:
+        return StreamListing.list(self._streams, self.stream_front, self.__stream_sort_value, kind=kind, sort=sort,
+                                  order=order, name=name, tag=tag, group=group, cursor=cursor, limit=limit)
+
     def find_stream_by_id(self, sid: str):
-        for stream in self._streams:
-            if stream.id == ObjectId(sid):
-                return stream
+        if sid not in self._streams:
+            return None
 
-        return None
+        stream = IStream.objects(id=sid).first()
+        if stream:
+            stream.set_server_settings(self._settings)
+        return stream
 
-    def get_user_role_by_id(self, uid: ObjectId) -> ProviderPair.Roles:
-        for user in self._settings.providers:
-            if user.user.id == uid:
-                return user.role
+    def find_streams_by_name(self, name: str) -> list:
+        return self._streams.find_by_name(name)
 
-        return ProviderPair.Roles.READ
+    def find_streams_by_tvg_id(self, tvg_id: str) -> list:
+        return self._streams.find_by_tvg_id(tvg_id)
 
     def add_stream(self, stream):
-        self.__init_stream_runtime_fields(stream)
-        self._streams.append(stream)
-        self._settings.streams.append(stream)
-        self._settings.save()
+        self.add_streams([stream])
 
     def add_streams(self, streams):
+        if not streams:
+            return
+
+        ServiceSettings.objects(id=self.id).update_one(add_to_set__streams=list(streams))
         for stream in streams:
-            self.__init_stream_runtime_fields(stream)
-            self._streams.append(stream)
-            self._settings.streams.append(stream)
-        self._settings.save()
+            self.__put_stream(stream)
+            self.__stream_config_changed(stream)
+        self.__notify_streams_changed([stream.id for stream in streams])
+
+    def import_streams(self, streams: list) -> ImportResult:
+        result, inserted = StreamImporter(self._settings).insert(streams)
+        for stream in inserted:
+            self.__put_stream(stream)
+            self.__stream_config_changed(stream)
+        if inserted:
+            self.__notify_streams_changed([stream.id for stream in inserted])
+        return result
 
     def update_stream(self, stream):
         stream.save()
+        self.__put_stream(stream)
+        self.__stream_config_changed(stream)
+        self.__notify_streams_changed([stream.id])
 
     def remove_stream(self, sid: str):
-        for stream in self._streams:
-            if stream.id == ObjectId(sid):
-                self._streams.remove(stream)
-                self._settings.streams.remove(stream)
-                break
+        if self.__drop_stream(sid):
+            self.__notify_streams_changed([], [sid])
+
+    def refresh_streams(self, added: list, updated: list, removed: list):
+        # the caller already stored the membership changes
+        for stream in IStream.objects(id__in=added + updated):
+            self.__put_stream(stream)
+            self.__stream_config_changed(stream)
+
+        for sid in removed:
+            self.__drop_stream(sid)
+
+        self.__notify_streams_changed(added + updated, removed)
+
+    def refresh_subscribers(self, added: list, removed: list):
+        for subscriber in Subscriber.objects(id__in=added):
+            self._client.update_subscriber_config(subscriber.id, subscriber.to_service(self._settings))
+        for sid in removed:
+            self._client.remove_subscriber_config(sid)
 
     def to_front(self) -> dict:
         return {ServiceFields.ID: str(self.id), ServiceFields.CPU: self._cpu, ServiceFields.GPU: self._gpu,
@@ -256,46 +537,15 @@ class Service(IStreamHandler):
                 ServiceFields.STATUS: self.status, ServiceFields.ONLINE_USERS: str(self.online_users),
                 ServiceFields.OS: str(self.os)}
 
-    def make_proxy_stream(self) -> ProxyStream:
-        return ProxyStream.make_stream(self._settings)
-
-    def make_relay_stream(self) -> RelayStream:
-        return RelayStream.make_stream(self._settings)
-
-    def make_vod_relay_stream(self) -> VodRelayStream:
-        return VodRelayStream.make_stream(self._settings)
-
-    def make_cod_relay_stream(self) -> CodRelayStream:
-        return CodRelayStream.make_stream(self._settings)
-
-    def make_encode_stream(self) -> EncodeStream:
-        return EncodeStream.make_stream(self._settings)
-
-    def make_vod_encode_stream(self) -> VodEncodeStream:
-        return VodEncodeStream.make_stream(self._settings)
-
-    def make_cod_encode_stream(self) -> CodEncodeStream:
-        return CodEncodeStream.make_stream(self._settings)
-
-    def make_timeshift_recorder_stream(self) -> TimeshiftRecorderStream:
-        return TimeshiftRecorderStream.make_stream(self._settings)
-
-    def make_catchup_stream(self) -> CatchupStream:
-        return CatchupStream.make_stream(self._settings)
-
-    def make_timeshift_player_stream(self) -> TimeshiftPlayerStream:
-        return TimeshiftPlayerStream.make_stream(self._settings)
-
-    def make_test_life_stream(self) -> TestLifeStream:
-        return TestLifeStream.make_stream(self._settings)
-
     # handler
     def on_stream_statistic_received(self, params: dict):
-        sid = params['id']
-        stream = self.find_stream_by_id(sid)
+        sid = params.get('id')
+        stream = self._streams.find_by_id(sid) if sid else None
         if stream:
-            stream.update_runtime_fields(params)
-            self.__notify_front(Service.STREAM_DATA_CHANGED, stream.to_front())
+            self._runtime.update(sid, params)
+            self.__add_stream_timeseries(sid)
+            front = self.stream_front(stream)
+            self.__notify_front(Service.STREAM_DATA_CHANGED, sid, front)
 
     def on_stream_sources_changed(self, params: dict):
         pass
@@ -303,30 +553,46 @@ class Service(IStreamHandler):
     def on_service_statistic_received(self, params: dict):
         # nid = params['id']
         self.__refresh_stats(params)
-        self.__notify_front(Service.SERVICE_DATA_CHANGED, self.to_front())
+        metrics = {metric: params.get(metric) for metric in Service.SERVICE_TIMESERIES_METRICS}
+        metrics[ServiceFields.LOAD_AVERAGE] = Service.__parse_load_average(params.get(ServiceFields.LOAD_AVERAGE))
+        self._service_timeseries.add(self.room, metrics)
+        self.__notify_front(Service.SERVICE_DATA_CHANGED, self.room, self.to_front())
 
     def on_quit_status_stream(self, params: dict):
         sid = params['id']
-        stream = self.find_stream_by_id(sid)
+        stream = self._streams.find_by_id(sid)
         if stream:
-            stream.reset()
-            self.__notify_front(Service.STREAM_DATA_CHANGED, stream.to_front())
+            self._runtime.reset(sid)
+            self.__notify_front(Service.STREAM_DATA_CHANGED, sid, self.stream_front(stream))
 
     def on_client_state_changed(self, status: ClientStatus):
+        self.__notify_connection_changed()
         if status == ClientStatus.ACTIVE:
-            self.sync(True)
+            self.sync(True, full=True)
         else:
             self.__reset()
-            for stream in self._streams:
-                stream.reset()
+            self._runtime.reset_all()
 
     def on_ping_received(self, params: dict):
         self.sync()
 
     # private
-    def __notify_front(self, channel: str, params: dict):
-        unique_channel = channel + '_' + str(self.id)
-        self._socketio.emit(unique_channel, params)
+    def __notify_connection_changed(self):
+        if not self._handler:
+            return
+
+        if self.is_connected():
+            self._handler.on_service_connected(self)
+        else:
+            self._handler.on_service_disconnected(self)
+
+    def __notify_streams_changed(self, sids: list, removed=None):
+        if self._handler:
+            self._handler.on_service_streams_changed(self, sids, removed)
+
+    def __notify_front(self, channel: str, key: str, params: dict):
+        FRONT_UPDATES.inc(self.id, channel)
+        self._emitter.emit(channel, self.room, key, params)
 
     def __reset(self):
         self._cpu = Service.INIT_VALUE
@@ -356,12 +622,59 @@ class Service(IStreamHandler):
         self._timestamp = stats[ServiceFields.TIMESTAMP]
         self._online_users = OnlineUsers(**stats[ServiceFields.ONLINE_USERS])
 
-    def __init_stream_runtime_fields(self, stream: IStream):
+    def __add_stream_timeseries(self, sid: str):
+        row = self._runtime.row(sid)
+        if row:
+            self._timeseries.add(str(sid), {'cpu': row.cpu, 'rss': row.rss, 'restarts': row.restarts,
+                                            'input_bps': row.input_bps, 'output_bps': row.output_bps})
+
+    def __stream_config_changed(self, stream: IStream):
+        self._client.update_stream_config(stream.id, stream.config())
+
+    @staticmethod
+    def __parse_load_average(value):
+        # nodes send the three averages as one string, e.g. '1.00 0.50 0.25'; the one minute value is kept
+        if isinstance(value, (int, float)):
+            return value
+        match = re.search(r'\d+(?:\.\d+)?', str(value)) if value is not None else None
+        return float(match.group()) if match else None
+
+    def __stream_sort_value(self, stream: StreamRecord, sort: str):
+        if sort == 'name':
+            return (stream.name or '').lower()
+        return self._runtime.get(stream.id, Service.RUNTIME_SORT_COLUMNS.get(sort, sort))
+
+    def __put_stream(self, stream: IStream):
         stream.set_server_settings(self._settings)
+        self._runtime.slot(stream.id)
+        self._streams.add(StreamRecord(stream))
+
+    def __drop_stream(self, sid) -> bool:
+        ServiceSettings.objects(id=self.id).update_one(pull__streams=ObjectId(sid))
+        if not self._streams.remove(sid):
+            return False
+
+        self._runtime.remove(sid)
+        self._timeseries.remove(str(sid))
+        self._emitter.forget(Service.STREAM_DATA_CHANGED, self.room, str(sid))
+        self._client.remove_stream_config(sid)
+        return True
+
+    def __stream_ids(self) -> list:
+        # read the references raw, going through settings.streams would load and keep every document
+        doc = ServiceSettings._get_collection().find_one({'_id': self.id}, {'streams': 1}) or {}
+        return [getattr(ref, 'id', ref) for ref in doc.get('streams', [])]
+
+    def __iter_streams(self):
+        for stream in IStream.objects(id__in=self.__stream_ids()):
+            stream.set_server_settings(self._settings)
+            yield stream
+
+    def __reload_settings(self) -> ServiceSettings:
+        return self._settings.reload(*Service.SETTINGS_RELOAD_FIELDS)
 
     def __reload_from_db(self):
-        self._streams = []
-        streams = self._settings.streams
-        for stream in streams:
-            self.__init_stream_runtime_fields(stream)
-            self._streams.append(stream)
+        self._streams.clear()
+        self._runtime.clear()
+        for stream in self.__iter_streams():
+            self.__put_stream(stream)
@@ -1,4 +1,8 @@
+import hashlib
+import json
+
 from bson.objectid import ObjectId
+from gevent.event import AsyncResult
 
 from pyfastocloud.fastocloud_client import FastoCloudClient, Fields
 from pyfastocloud.client_handler import IClientHandler
@@ -7,6 +11,9 @@ from pyfastocloud.client_constants import Commands, ClientStatus
 
 from app.service.stream_handler import IStreamHandler
 import app.common.constants as constants
+from app.metrics.metrics import MESSAGES, HANDLER_TIME, SYNC_PAYLOAD, RECV_BATCH_FRAMES, RECV_BATCH_BYTES
+from app.service.frame_reader import FrameReader, FrameError
+from app.service.rpc import PendingRequests
 
 
 class OperationSystem(object):
@@ -21,6 +28,61 @@ class OperationSystem(object):
         return '{0} {1}({2})'.format(self.name, self.version, self.arch)
 
 
+class SyncState(object):
+    # config hashes the node acknowledged, and the configs changed since then
+    def __init__(self):
+        self._acked = {}
+        self._changed = {}
+        self._removals = 0
+        self._synced_removals = 0
+
+    def update(self, sid: str, config: dict):
+        config_hash = SyncState.hash(config)
+        if self._acked.get(sid) == config_hash:
+            self._changed.pop(sid, None)
+        else:
+            self._changed[sid] = (config, config_hash)
+
+    def remove(self, sid: str):
+        # sync_service has no removal list, the next sync has to be a full one
+        self._acked.pop(sid, None)
+        self._changed.pop(sid, None)
+        self._removals += 1
+
+    def has_changed(self) -> bool:
+        return bool(self._changed)
+
+    def has_removed(self) -> bool:
+        return self._removals != self._synced_removals
+
+    def changed(self) -> (list, dict):
+        return [config for config, _ in self._changed.values()], {sid: h for sid, (_, h) in self._changed.items()}
+
+    def removals(self) -> int:
+        return self._removals
+
+    def acknowledge(self, hashes: dict, full_removals=None):
+        if full_removals is not None:
+            self._acked = dict(hashes)
+            self._synced_removals = full_removals
+        else:
+            self._acked.update(hashes)
+
+        for sid, config_hash in hashes.items():
+            changed = self._changed.get(sid)
+            if changed and changed[1] == config_hash:
+                del self._changed[sid]
+
+    def reset(self):
+        self._acked = {}
+        self._changed = {}
+        self._synced_removals = self._removals
+
+    @staticmethod
+    def hash(config: dict) -> str:
+        return hashlib.md5(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
 class ServiceClient(IClientHandler):
     HTTP_HOST = 'http_host'
     VODS_HOST = 'vods_host'
@@ -29,6 +91,7 @@ class ServiceClient(IClientHandler):
     BANDWIDTH_HOST = 'bandwidth_host'
     VERSION = 'version'
     OS = 'os'
+    BATCHED_RECEIVE = True
 
     @staticmethod
     def get_log_service_path(host: str, port: int, sid: str):
@@ -47,9 +110,16 @@ class ServiceClient(IClientHandler):
         self._request_id = 0
         self._handler = handler
         self._client = FastoCloudClient(host, port, self)
+        self._stream_sync = SyncState()
+        self._subscriber_sync = SyncState()
+        self._pending_syncs = {}
+        self._full_sync_requested = False
+        self._requests = PendingRequests(sid)
+        self._reader = FrameReader()
         self._set_runtime_fields()
 
     def connect(self):
+        self._reader.reset()
         self._client.connect()
 
     def is_connected(self):
@@ -59,73 +129,182 @@ class ServiceClient(IClientHandler):
         return self._client.socket()
 
     def recv_data(self):
-        data = self._client.read_command()
-        self._client.process_commands(data)
-
-    def status(self) -> ClientStatus:
-        return self._client.status()
-
-    def disconnect(self):
-        self._client.disconnect()
-
-    def activate(self, license_key: str):
-        return self._client.activate(self._gen_request_id(), license_key)
-
-    def ping_service(self):
-        return self._client.ping_service(self._gen_request_id())
-
-    def stop_service(self, delay: int):
-        return self._client.stop_service(self._gen_request_id(), delay)
-
-    def get_log_service(self, host: str, port: int):
-        return self._client.get_log_service(self._gen_request_id(),
-                                            ServiceClient.get_log_service_path(host, port, str(self.id)))
-
-    def start_stream(self, config: dict):
-        return self._client.start_stream(self._gen_request_id(), config)
-
-    def stop_stream(self, stream_id: str):
-        return self._client.stop_stream(self._gen_request_id(), stream_id)
+        if not ServiceClient.BATCHED_RECEIVE:
+            data = self._client.read_command()
+            self._process_frame(data)
+            return
 
-    def restart_stream(self, stream_id: str):
-        return self._client.restart_stream(self._gen_request_id(), stream_id)
+        sock = self._client.socket()
+        if not sock:
+            return
 
-    def get_log_stream(self, host: str, port: int, stream_id: str, feedback_directory: str):
-        return self._client.get_log_stream(self._gen_request_id(), stream_id, feedback_directory,
-                                           ServiceClient.get_log_stream_path(host, port, stream_id))
+        try:
+            read = self._reader.read_available(sock)
+        except OSError as e:
+            print('Caught exception while reading from service: {0}'.format(e))
+            read = -1
 
-    def get_pipeline_stream(self, host: str, port: int, stream_id: str, feedback_directory: str):
-        return self._client.get_pipeline_stream(self._gen_request_id(), stream_id, feedback_directory,
-                                                ServiceClient.get_pipeline_stream_path(host, port, stream_id))
+        if read < 0:
+            self._reader.reset()
+            self._client.disconnect()
+            return
 
-    def sync_service(self, settings):
-        if not settings:
+        try:
+            frames = self._reader.frames()
+        except FrameError as e:
+            print('Caught exception while reading from service: {0}'.format(e))
+            self._reader.reset()
+            self._client.disconnect()
             return
 
-        streams = []
-        for stream in settings.streams:
-            stream.set_server_settings(settings)
-            streams.append(stream.config())
+        RECV_BATCH_FRAMES.observe(len(frames))
+        RECV_BATCH_BYTES.observe(read)
+        # one broken frame must not drop the rest of the wakeup
+        for frame in frames:
+            self._process_frame(frame)
 
-        subscribers = []
-        for subs in settings.subscribers:
-            conf = subs.to_service(settings)
-            subscribers.append(conf)
+    def status(self) -> ClientStatus:
+        return self._client.status()
 
-        return self._client.sync_service(self._gen_request_id(), streams, subscribers)
+    def disconnect(self):
+        self._client.disconnect()
+
+    def activate(self, license_key: str) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'activate')
+        self._client.activate(request_id, license_key)
+        return result
+
+    def ping_service(self) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'ping')
+        self._client.ping_service(request_id)
+        return result
+
+    def stop_service(self, delay: int) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'stop_service')
+        self._client.stop_service(request_id, delay)
+        return result
+
+    def get_log_service(self, host: str, port: int) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'get_log_service')
+        self._client.get_log_service(request_id, ServiceClient.get_log_service_path(host, port, str(self.id)))
+        return result
+
+    def start_stream(self, config: dict) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'start_stream')
+        self._client.start_stream(request_id, config)
+        return result
+
+    def stop_stream(self, stream_id: str) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'stop_stream')
+        self._client.stop_stream(request_id, stream_id)
+        return result
+
+    def restart_stream(self, stream_id: str) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'restart_stream')
+        self._client.restart_stream(request_id, stream_id)
+        return result
+
+    def cancel_request(self, result: AsyncResult):
+        self._requests.cancel(result)
+
+    def pending_requests(self) -> int:
+        return len(self._requests)
+
+    def get_log_stream(self, host: str, port: int, stream_id: str, feedback_directory: str) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'get_log_stream')
+        self._client.get_log_stream(request_id, stream_id, feedback_directory,
+                                    ServiceClient.get_log_stream_path(host, port, stream_id))
+        return result
+
+    def get_pipeline_stream(self, host: str, port: int, stream_id: str, feedback_directory: str) -> AsyncResult:
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'get_pipeline_stream')
+        self._client.get_pipeline_stream(request_id, stream_id, feedback_directory,
+                                         ServiceClient.get_pipeline_stream_path(host, port, stream_id))
+        return result
+
+    def update_stream_config(self, sid, config: dict):
+        self._stream_sync.update(str(sid), config)
+
+    def remove_stream_config(self, sid):
+        self._stream_sync.remove(str(sid))
+
+    def update_subscriber_config(self, sid, config: dict):
+        self._subscriber_sync.update(str(sid), config)
+
+    def remove_subscriber_config(self, sid):
+        self._subscriber_sync.remove(str(sid))
+
+    def needs_full_sync(self) -> bool:
+        return self._full_sync_requested or self._stream_sync.has_removed() or self._subscriber_sync.has_removed()
+
+    def request_full_sync(self):
+        self._full_sync_requested = True
+
+    def sync_service(self, settings=None, full=True, stream_documents=None):
+        if full:
+            if not settings:
+                return
+
+            streams = []
+            stream_hashes = {}
+            for stream in settings.streams if stream_documents is None else stream_documents:
+                stream.set_server_settings(settings)
+                config = stream.config()
+                streams.append(config)
+                stream_hashes[str(stream.id)] = SyncState.hash(config)
+
+            subscribers = []
+            subscriber_hashes = {}
+            for subs in settings.subscribers:
+                config = subs.to_service(settings)
+                subscribers.append(config)
+                subscriber_hashes[str(subs.id)] = SyncState.hash(config)
+            synced = (stream_hashes, subscriber_hashes, self._stream_sync.removals(), self._subscriber_sync.removals())
+            self._full_sync_requested = False
+        else:
+            # one incremental sync at a time, whatever is not acknowledged goes with the next one
+            if self._pending_syncs or not (self._stream_sync.has_changed() or self._subscriber_sync.has_changed()):
+                return
+
+            streams, stream_hashes = self._stream_sync.changed()
+            subscribers, subscriber_hashes = self._subscriber_sync.changed()
+            synced = (stream_hashes, subscriber_hashes, None, None)
+
+        SYNC_PAYLOAD.observe(len(json.dumps(streams, default=str)) + len(json.dumps(subscribers, default=str)),
+                             self.id)
+        request_id = self._gen_request_id()
+        key = str(request_id)
+        self._pending_syncs[key] = synced
+        result = self._track_request(request_id, 'sync')
+        # a sync that timed out or got cancelled must not stay pending
+        result.rawlink(lambda _: self._pending_syncs.pop(key, None))
+        self._client.sync_service(request_id, streams, subscribers)
+        return result
 
     def prepare_service(self, settings):
         if not settings:
             return
 
-        return self._client.prepare_service(self._gen_request_id(), settings.feedback_directory,
-                                            settings.timeshifts_directory,
-                                            settings.hls_directory,
-                                            settings.playlists_directory,
-                                            settings.dvb_directory,
-                                            settings.capture_card_directory,
-                                            settings.vods_in_directory,
-                                            settings.vods_directory, settings.cods_directory)
+        request_id = self._gen_request_id()
+        result = self._track_request(request_id, 'prepare')
+        self._client.prepare_service(request_id, settings.feedback_directory,
+                                     settings.timeshifts_directory,
+                                     settings.hls_directory,
+                                     settings.playlists_directory,
+                                     settings.dvb_directory,
+                                     settings.capture_card_directory,
+                                     settings.vods_in_directory,
+                                     settings.vods_directory, settings.cods_directory)
+        return result
 
     def get_http_host(self) -> str:
         return self._http_host
@@ -156,6 +335,30 @@ class ServiceClient(IClientHandler):
         if not req:
             return
 
+        MESSAGES.inc(self.id, 'response', req.method)
+        with HANDLER_TIME.time(self.id, 'response'):
+            self._process_response(req, resp)
+
+    def process_request(self, req: Request):
+        if not req:
+            return
+
+        MESSAGES.inc(self.id, 'request', req.method)
+        with HANDLER_TIME.time(self.id, 'request'):
+            self._process_request(req)
+
+    def on_client_state_changed(self, status: ClientStatus):
+        if status != ClientStatus.ACTIVE:
+            self._set_runtime_fields()
+            self._reset_sync_state()
+            self._requests.cancel_all('disconnected')
+        if self._handler:
+            self._handler.on_client_state_changed(status)
+
+    # private
+    def _process_response(self, req: Request, resp: Response):
+        self._requests.resolve(req.id, resp)
+
         if req.method == Commands.ACTIVATE_COMMAND and resp.is_message():
             if self._handler:
                 result = resp.result
@@ -169,16 +372,20 @@ class ServiceClient(IClientHandler):
                                          result[ServiceClient.VERSION], os)
                 self._handler.on_service_statistic_received(result)
 
+        if req.method == Commands.SYNC_SERVICE_COMMAND:
+            synced = self._pending_syncs.pop(str(req.id), None)
+            if synced and resp.is_message():
+                stream_hashes, subscriber_hashes, stream_removals, subscriber_removals = synced
+                self._stream_sync.acknowledge(stream_hashes, stream_removals)
+                self._subscriber_sync.acknowledge(subscriber_hashes, subscriber_removals)
+
         if req.method == Commands.PREPARE_SERVICE_COMMAND and resp.is_message():
             for directory in resp.result:
                 if Fields.VODS_IN_DIRECTORY in directory:
                     self._vods_in = directory[Fields.VODS_IN_DIRECTORY]['content']
                     break
 
-    def process_request(self, req: Request):
-        if not req:
-            return
-
+    def _process_request(self, req: Request):
         if not self._handler:
             return
 
@@ -193,13 +400,6 @@ class ServiceClient(IClientHandler):
         elif req.method == Commands.CLIENT_PING_COMMAND:
             self._handler.on_ping_received(req.params)
 
-    def on_client_state_changed(self, status: ClientStatus):
-        if status != ClientStatus.ACTIVE:
-            self._set_runtime_fields()
-        if self._handler:
-            self._handler.on_client_state_changed(status)
-
-    # private
     def _set_runtime_fields(self, http_host=None, vods_host=None, cods_host=None, subscribers_host=None,
                             bandwidth_host=None,
                             version=None,
@@ -214,7 +414,21 @@ class ServiceClient(IClientHandler):
         self._os = os
         self._vods_in = vods_in
 
+    def _track_request(self, request_id: int, method: str) -> AsyncResult:
+        return self._requests.track(request_id, method)
+
+    def _reset_sync_state(self):
+        self._stream_sync.reset()
+        self._subscriber_sync.reset()
+        self._pending_syncs = {}
+
     def _gen_request_id(self) -> int:
         current_value = self._request_id
         self._request_id += 1
         return current_value
+
+    def _process_frame(self, data):
+        try:
+            self._client.process_commands(data)
+        except Exception as e:
+            print('Caught exception while processing service frame: {0}'.format(e))
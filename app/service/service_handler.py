@@ -0,0 +1,16 @@
+from abc import ABC, abstractmethod
+
+
+# handler for service connections
+class IServiceHandler(ABC):
+    @abstractmethod
+    def on_service_connected(self, service):
+        pass
+
+    @abstractmethod
+    def on_service_disconnected(self, service):
+        pass
+
+    @abstractmethod
+    def on_service_streams_changed(self, service, sids: list, removed=None):
+        pass
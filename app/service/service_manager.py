@@ -1,42 +1,313 @@
+import random
+import time
+
+import gevent
+from gevent.pool import Pool
+from bson.objectid import ObjectId
+
 from app.common.service.entry import ServiceSettings
 from app.service.service import Service
+from app.service.service_handler import IServiceHandler
+from app.service.emitter import CoalescingEmitter
+from app.service.playlist_cache import PlaylistCache
+from app.metrics.metrics import registry, LoopLagMonitor, LOOP_ITERATIONS, DISPATCH_TIME, SERVICE_CONNECTED, \
+    SERVICE_RECONNECTS, CLIENT_QUEUE_DEPTH, CLIENT_DROPPED
+
+
+class LoopStatistics(object):
+    __slots__ = ['iterations', 'dispatched', 'dispatch_time_total', 'dispatch_time_max']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.iterations = 0
+        self.dispatched = 0
+        self.dispatch_time_total = 0.0
+        self.dispatch_time_max = 0.0
+
+    def add_dispatch(self, elapsed: float):
+        self.dispatched += 1
+        self.dispatch_time_total += elapsed
+        if elapsed > self.dispatch_time_max:
+            self.dispatch_time_max = elapsed
+
+    def to_dict(self) -> dict:
+        avg = self.dispatch_time_total / self.dispatched if self.dispatched else 0.0
+        return {'iterations': self.iterations, 'dispatched': self.dispatched, 'dispatch_time_avg': avg,
+                'dispatch_time_max': self.dispatch_time_max}
+
+
+class ConnectionStatus:
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    BACKOFF = 'backoff'
+
+
+class ConnectionState(object):
+    __slots__ = ['status', 'attempts', 'retry', 'next_attempt', 'changed']
+
+    def __init__(self):
+        self.status = ConnectionStatus.DISCONNECTED
+        self.attempts = 0
+        self.retry = None
+        self.next_attempt = None
+        self.changed = time.time()
+
+    def set_status(self, status: str):
+        if self.status != status:
+            self.status = status
+            self.changed = time.time()
 
+    def cancel_retry(self):
+        if self.retry:
+            self.retry.kill(block=False)
+        self.retry = None
+        self.next_attempt = None
 
-class ServiceManager(object):
-    def __init__(self, host: str, port: int, socketio):
+    def to_dict(self) -> dict:
+        return {'status': self.status, 'attempts': self.attempts, 'next_attempt': self.next_attempt,
+                'changed': self.changed}
+
+
+class ServiceManager(IServiceHandler):
+    POLL_TIMEOUT_MSEC = 1000
+    DEFAULT_CONNECT_CONCURRENCY = 32
+    RECONNECT_BASE_SEC = 1
+    DEFAULT_RECONNECT_MAX_SEC = 30
+
+    def __init__(self, host: str, port: int, socketio, emit_window_msec=0, playlist_cache: PlaylistCache = None,
+                 connect_concurrency=DEFAULT_CONNECT_CONCURRENCY, reconnect_max_sec=DEFAULT_RECONNECT_MAX_SEC,
+                 client_queue_size=CoalescingEmitter.DEFAULT_CLIENT_QUEUE_SIZE):
+        from gevent import select
         self._host = host
         self._port = port
-        self._socketio = socketio
+        self._emitter = CoalescingEmitter(socketio, emit_window_msec, client_queue_size)
+        registry.add_collector(self.__collect_client_metrics)
+        self._playlist_cache = playlist_cache
         self._stop_listen = False
-        self._servers_pool = []
+        self._servers_pool = {}
+        self._poller = select.poll()
+        self._fd_to_server = {}
+        self._server_to_fd = {}
+        self._stats = LoopStatistics()
+        self._lag_monitor = LoopLagMonitor()
+        self._connect_concurrency = connect_concurrency
+        self._reconnect_max = reconnect_max_sec
+        self._connections = {}
 
     def stop(self):
         self._stop_listen = True
+        self._lag_monitor.stop()
+        for state in self._connections.values():
+            state.cancel_retry()
+
+    def connect_all(self):
+        pool = Pool(self._connect_concurrency)
+        for settings in ServiceSettings.objects():
+            server = self.find_or_create_server(settings)
+            if not server.is_connected():
+                pool.spawn(self.__connect, server)
+        pool.join()
+
+    def connection_states(self) -> dict:
+        return {str(sid): state.to_dict() for sid, state in self._connections.items()}
 
     def find_or_create_server(self, settings: ServiceSettings) -> Service:
-        for server in self._servers_pool:
-            if server.id == settings.id:
-                return server
+        server = self._servers_pool.get(settings.id)
+        if server:
+            return server
 
-        server = Service(self._host, self._port, self._socketio, settings)
+        server = Service(self._host, self._port, self._emitter, settings, self)
         self.__add_server(server)
         return server
 
+    def find_or_create_server_by_id(self, sid: str) -> Service:
+        server = self._servers_pool.get(ObjectId(sid))
+        if server:
+            return server
+
+        settings = ServiceSettings.objects(id=sid).first()
+        if not settings:
+            return None
+        return self.find_or_create_server(settings)
+
+    def playlist_revision(self, key: str) -> int:
+        return self._playlist_cache.revision(key) if self._playlist_cache else 0
+
+    def playlist_invalidate(self, key: str):
+        if self._playlist_cache:
+            self._playlist_cache.invalidate(key)
+
+    def playlist_invalidate_many(self, keys: list):
+        if self._playlist_cache:
+            self._playlist_cache.invalidate_many(keys)
+
+    def playlist_forget(self, keys: list):
+        if self._playlist_cache:
+            self._playlist_cache.forget(keys)
+
+    def reload_providers(self, sid):
+        server = self._servers_pool.get(ObjectId(sid))
+        if server:
+            server.reload_providers()
+
+    def reload_settings(self, sid):
+        server = self._servers_pool.get(ObjectId(sid))
+        if server:
+            server.reload_settings()
+
+    def refresh_subscribers(self, sid, added=None, removed=None):
+        server = self._servers_pool.get(ObjectId(sid))
+        if server:
+            server.refresh_subscribers(added or [], removed or [])
+
+    def attach_client(self, client_sid: str, room: str):
+        self._emitter.attach(client_sid, room)
+
+    def detach_client(self, client_sid: str):
+        self._emitter.detach(client_sid)
+
+    def request_snapshot(self, client_sid: str):
+        self._emitter.request_snapshot(client_sid)
+
+    def client_stats(self) -> dict:
+        return self._emitter.client_stats()
+
+    def collect_metrics(self) -> list:
+        return registry.collect()
+
+    def loop_stats(self) -> dict:
+        stats = self._stats.to_dict()
+        stats['services'] = len(self._servers_pool)
+        stats['connected'] = len(self._fd_to_server)
+        return stats
+
     def refresh(self):
         from gevent import select
+        self._lag_monitor.start()
         while not self._stop_listen:
-            sockets = []
-            for server in self._servers_pool:
-                if server.is_connected():
-                    sockets.append(server.socket())
-
-            readable, _, _ = select.select(sockets, [], [], 1)
-            for read in readable:
-                for server in self._servers_pool:
-                    if server.socket() == read:
-                        server.recv_data()
-                        break
+            events = self._poller.poll(ServiceManager.POLL_TIMEOUT_MSEC)
+            self._stats.iterations += 1
+            LOOP_ITERATIONS.inc()
+            for fd, event in events:
+                server = self._fd_to_server.get(fd)
+                if not server:
+                    continue
+
+                if event & select.POLLNVAL:
+                    # the fd is already closed, the client has to forget it before a reconnect is possible
+                    server.drop_connection()
+                    self.on_service_disconnected(server)
+                    continue
+
+                if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                    start = time.monotonic()
+                    server.recv_data()
+                    elapsed = time.monotonic() - start
+                    self._stats.add_dispatch(elapsed)
+                    DISPATCH_TIME.observe(elapsed, server.id)
+
+    # handler
+    def on_service_connected(self, service: Service):
+        from gevent import select
+        state = self.__connection_state(service)
+        state.cancel_retry()
+        state.attempts = 0
+        state.set_status(ConnectionStatus.CONNECTED)
+        SERVICE_CONNECTED.set(1, service.id)
+        if service.id in self._server_to_fd:
+            return
+
+        sock = service.socket()
+        if not sock:
+            return
+
+        fd = sock.fileno()
+        # a connected socket is always writable, only wake up for incoming data
+        self._poller.register(fd, select.POLLIN)
+        self._fd_to_server[fd] = service
+        self._server_to_fd[service.id] = fd
+
+    def on_service_disconnected(self, service: Service):
+        SERVICE_CONNECTED.set(0, service.id)
+        if service.keep_connected and not self._stop_listen:
+            self.__schedule_reconnect(service)
+        else:
+            state = self.__connection_state(service)
+            state.cancel_retry()
+            state.set_status(ConnectionStatus.DISCONNECTED)
+
+        fd = self._server_to_fd.pop(service.id, None)
+        if fd is None:
+            return
+
+        self._fd_to_server.pop(fd, None)
+        try:
+            self._poller.unregister(fd)
+        except KeyError:
+            pass
+
+    def on_service_streams_changed(self, service: Service, sids: list, removed=None):
+        if not self._playlist_cache:
+            return
+
+        self._playlist_cache.invalidate(PlaylistCache.service_key(service.id))
+        self._playlist_cache.invalidate_many([PlaylistCache.stream_key(sid) for sid in sids])
+        if removed:
+            self._playlist_cache.forget([PlaylistCache.stream_key(sid) for sid in removed])
 
     # private
+    def __collect_client_metrics(self):
+        CLIENT_QUEUE_DEPTH.clear()
+        CLIENT_DROPPED.clear()
+        for client_sid, stats in self._emitter.client_stats().items():
+            CLIENT_QUEUE_DEPTH.set(stats['depth'], client_sid)
+            CLIENT_DROPPED.set(stats['dropped'], client_sid)
+
+    def __connection_state(self, server: Service) -> ConnectionState:
+        state = self._connections.get(server.id)
+        if not state:
+            state = ConnectionState()
+            self._connections[server.id] = state
+        return state
+
+    def __connect(self, server: Service):
+        state = self.__connection_state(server)
+        state.set_status(ConnectionStatus.CONNECTING)
+        try:
+            server.connect()
+        except Exception as e:
+            print('Caught exception while connecting to service {0}: {1}'.format(server.id, e))
+
+        if not server.is_connected():
+            self.__schedule_reconnect(server)
+
+    def __reconnect(self, server: Service):
+        state = self.__connection_state(server)
+        state.retry = None
+        state.next_attempt = None
+        if server.is_connected() or not server.keep_connected:
+            return
+
+        SERVICE_RECONNECTS.inc(server.id)
+        self.__connect(server)
+
+    def __schedule_reconnect(self, server: Service):
+        state = self.__connection_state(server)
+        if state.retry:
+            return
+
+        # full jitter keeps a restarted fleet from reconnecting in lockstep
+        ceiling = min(self._reconnect_max, ServiceManager.RECONNECT_BASE_SEC * 2 ** min(state.attempts, 16))
+        delay = random.uniform(ServiceManager.RECONNECT_BASE_SEC / 2, ceiling)
+        state.attempts += 1
+        state.next_attempt = time.time() + delay
+        state.set_status(ConnectionStatus.BACKOFF)
+        state.retry = gevent.spawn_later(delay, self.__reconnect, server)
+
     def __add_server(self, server: Service):
-        self._servers_pool.append(server)
+        self._servers_pool[server.id] = server
+        if server.is_connected():
+            self.on_service_connected(server)
@@ -0,0 +1,102 @@
+from mongoengine import ValidationError
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.common.service.entry import ServiceSettings
+from app.common.stream.entry import IStream
+
+
+class StreamImportError(Exception):
+    pass
+
+
+class ImportResult(object):
+    __slots__ = ['inserted', 'skipped', 'failed']
+
+    def __init__(self, inserted=0, skipped=0, failed=0):
+        self.inserted = inserted
+        self.skipped = skipped
+        self.failed = failed
+
+    def merge(self, other):
+        self.inserted += other.inserted
+        self.skipped += other.skipped
+        self.failed += other.failed
+
+    def to_dict(self) -> dict:
+        return {'inserted': self.inserted, 'skipped': self.skipped, 'failed': self.failed}
+
+    def __str__(self):
+        return 'inserted:{0} skipped:{1} failed:{2}'.format(self.inserted, self.skipped, self.failed)
+
+
+class StreamImporter(object):
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, settings: ServiceSettings, batch_size=DEFAULT_BATCH_SIZE):
+        self._settings = settings
+        self._batch_size = batch_size
+
+    def insert(self, streams: list):
+        result = ImportResult()
+        valid = []
+        for stream in streams:
+            try:
+                stream.validate()
+            except ValidationError:
+                result.skipped += 1
+                continue
+            valid.append(stream)
+
+        collection = IStream._get_collection()
+        inserted = []
+        for start in range(0, len(valid), self._batch_size):
+            batch = valid[start:start + self._batch_size]
+            docs = [stream.to_mongo() for stream in batch]
+            failed_indexes = set()
+            try:
+                collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # rejected documents (duplicates, validation), the rest of the batch is written
+                failed_indexes = {error['index'] for error in e.details.get('writeErrors', [])}
+            except PyMongoError as e:
+                # nothing tells which documents made it, undo the whole call so the caller can retry it
+                print('Caught exception while inserting streams: {0}'.format(e))
+                written = [stream.id for stream in inserted] + [doc['_id'] for doc in docs if '_id' in doc]
+                StreamImporter.__discard(collection, written)
+                raise StreamImportError(str(e))
+
+            for index, (stream, doc) in enumerate(zip(batch, docs)):
+                if index in failed_indexes or '_id' not in doc:
+                    result.failed += 1
+                    continue
+
+                stream.id = doc['_id']
+                stream._created = False
+                stream._clear_changed_fields()
+                inserted.append(stream)
+
+        if not inserted:
+            return result, inserted
+
+        ids = [stream.id for stream in inserted]
+        try:
+            ServiceSettings._get_collection().update_one({'_id': self._settings.id},
+                                                         {'$push': {'streams': {'$each': ids}}})
+        except PyMongoError as e:
+            print('Caught exception while attaching streams: {0}'.format(e))
+            StreamImporter.__discard(collection, ids)
+            raise StreamImportError(str(e))
+
+        result.inserted += len(inserted)
+        return result, inserted
+
+    # private
+    @staticmethod
+    def __discard(collection, ids: list):
+        if not ids:
+            return
+
+        try:
+            collection.delete_many({'_id': {'$in': ids}})
+        except PyMongoError as e:
+            print('Caught exception while discarding streams: {0}'.format(e))
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+
+import app.common.constants as constants
+
+
+class StreamKind:
+    STREAMS = 'streams'
+    VODS = 'vods'
+    CODS = 'cods'
+    PROXY = 'proxy'
+
+    ALL = [STREAMS, VODS, CODS, PROXY]
+
+
+class StreamListing(object):
+    DEFAULT_LIMIT = 100
+    MAX_LIMIT = 1000
+    SORT_FIELDS = ['name', 'status', 'cpu', 'rss', 'restarts', 'bps', 'out_bps']
+
+    KIND_TYPES = {StreamKind.VODS: [constants.StreamType.VOD_RELAY, constants.StreamType.VOD_ENCODE],
+                  StreamKind.CODS: [constants.StreamType.COD_RELAY, constants.StreamType.COD_ENCODE],
+                  StreamKind.PROXY: [constants.StreamType.PROXY]}
+
+    @staticmethod
+    def kind_of(stream) -> str:
+        stream_type = stream.get_type()
+        for kind, types in StreamListing.KIND_TYPES.items():
+            if stream_type in types:
+                return kind
+        return StreamKind.STREAMS
+
+    @staticmethod
+    def list(streams, make_front, sort_value, kind=None, sort='name', order='asc', name=None, tag=None, group=None,
+             cursor=None, limit=DEFAULT_LIMIT) -> dict:
+        if sort not in StreamListing.SORT_FIELDS:
+            sort = 'name'
+        descending = order == 'desc'
+        limit = max(1, min(limit or StreamListing.DEFAULT_LIMIT, StreamListing.MAX_LIMIT))
+        name = name.lower() if name else None
+
+        # sort on static fields and runtime table values, fronts are only built for the returned page
+        rows = []
+        for stream in streams:
+            if kind and StreamListing.kind_of(stream) != kind:
+                continue
+            if name and name not in (stream.name or '').lower():
+                continue
+            if tag and tag not in (stream.tags or []):
+                continue
+            if group and group != stream.group_title:
+                continue
+
+            rows.append((sort_value(stream, sort), str(stream.id), stream))
+
+        rows.sort(key=lambda row: (row[0], row[1]), reverse=descending)
+        total = len(rows)
+
+        after = StreamListing.decode_cursor(cursor, sort)
+        start = 0
+        if after:
+            for index, (key, sid, _) in enumerate(rows):
+                if (key, sid) < after if descending else (key, sid) > after:
+                    start = index
+                    break
+            else:
+                start = total
+
+        page = rows[start:start + limit]
+        next_cursor = None
+        if start + limit < total:
+            key, sid, _ = page[-1]
+            next_cursor = StreamListing.__encode_cursor(sort, key, sid)
+
+        return {'streams': [make_front(stream) for _, _, stream in page], 'next_cursor': next_cursor, 'total': total}
+
+    @staticmethod
+    def is_valid_cursor(cursor: str, sort: str) -> bool:
+        if sort not in StreamListing.SORT_FIELDS:
+            sort = 'name'
+        return not cursor or StreamListing.decode_cursor(cursor, sort) is not None
+
+    # a cursor from another sort or an edited one decodes to None and the listing starts from the first page
+    @staticmethod
+    def decode_cursor(cursor: str, sort: str):
+        if not cursor:
+            return None
+
+        try:
+            cursor_sort, key, sid = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (ValueError, TypeError, binascii.Error):
+            return None
+
+        if cursor_sort != sort or not isinstance(sid, str):
+            return None
+        if sort == 'name':
+            if not isinstance(key, str):
+                return None
+        elif isinstance(key, bool) or not isinstance(key, (int, float)):
+            return None
+        return key, sid
+
+    # private
+    @staticmethod
+    def __encode_cursor(sort: str, key, sid: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps([sort, key, sid]).encode('utf-8')).decode('ascii')
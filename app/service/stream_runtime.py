@@ -0,0 +1,202 @@
+import math
+from array import array
+
+
+class StreamRuntimeFields:
+    STATUS = 'status'
+    CPU = 'cpu'
+    RSS = 'rss'
+    RESTARTS = 'restarts'
+    TIMESTAMP = 'timestamp'
+    IDLE_TIME = 'idle_time'
+    START_TIME = 'start_time'
+    LOOP_START_TIME = 'loop_start_time'
+    INPUT_STREAMS = 'input_streams'
+    OUTPUT_STREAMS = 'output_streams'
+
+
+class StreamRuntimeTable(object):
+    COLUMNS = ((StreamRuntimeFields.STATUS, 'b'), (StreamRuntimeFields.CPU, 'f'), (StreamRuntimeFields.RSS, 'q'),
+               (StreamRuntimeFields.RESTARTS, 'l'), (StreamRuntimeFields.TIMESTAMP, 'q'),
+               (StreamRuntimeFields.IDLE_TIME, 'q'), (StreamRuntimeFields.START_TIME, 'q'),
+               (StreamRuntimeFields.LOOP_START_TIME, 'q'))
+    INPUT_BPS = 'input_bps'
+    OUTPUT_BPS = 'output_bps'
+    MAX_BPS = 2 ** 63 - 1
+    MAX_FLOAT = 3.4e38
+
+    def __init__(self):
+        self._columns = {name: array(typecode) for name, typecode in StreamRuntimeTable.COLUMNS}
+        self._input_bps = array('q')
+        self._output_bps = array('q')
+        # input/output stream descriptions are variable sized, keep them aside
+        self._input_streams = []
+        self._output_streams = []
+        self._slots = {}
+        self._free = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, sid):
+        return str(sid) in self._slots
+
+    def slot(self, sid) -> int:
+        sid = str(sid)
+        slot = self._slots.get(sid)
+        if slot is not None:
+            return slot
+
+        if self._free:
+            slot = self._free.pop()
+            self.__clear(slot)
+        else:
+            slot = len(self._input_streams)
+            for column in self._columns.values():
+                column.append(0)
+            self._input_bps.append(0)
+            self._output_bps.append(0)
+            self._input_streams.append([])
+            self._output_streams.append([])
+        self._slots[sid] = slot
+        return slot
+
+    def row(self, sid):
+        slot = self._slots.get(str(sid))
+        if slot is None:
+            return None
+        return StreamRuntimeRow(self, slot)
+
+    # values come straight from the service json, a field that doesn't fit its column is skipped
+    def update(self, sid, params: dict):
+        slot = self.slot(sid)
+        for name, column in self._columns.items():
+            value = params.get(name)
+            if value is None:
+                continue
+
+            try:
+                if column.typecode == 'f':
+                    value = float(value)
+                    if not math.isfinite(value) or abs(value) > StreamRuntimeTable.MAX_FLOAT:
+                        continue
+                else:
+                    value = int(value)
+                column[slot] = value
+            except (TypeError, ValueError, OverflowError):
+                continue
+
+        input_streams = params.get(StreamRuntimeFields.INPUT_STREAMS)
+        if isinstance(input_streams, list):
+            self._input_streams[slot] = input_streams
+            self._input_bps[slot] = StreamRuntimeTable.__total_bps(input_streams)
+        output_streams = params.get(StreamRuntimeFields.OUTPUT_STREAMS)
+        if isinstance(output_streams, list):
+            self._output_streams[slot] = output_streams
+            self._output_bps[slot] = StreamRuntimeTable.__total_bps(output_streams)
+
+    def reset(self, sid):
+        slot = self._slots.get(str(sid))
+        if slot is not None:
+            self.__clear(slot)
+
+    def reset_all(self):
+        for slot in self._slots.values():
+            self.__clear(slot)
+
+    def remove(self, sid):
+        slot = self._slots.pop(str(sid), None)
+        if slot is not None:
+            self.__clear(slot)
+            self._free.append(slot)
+
+    def clear(self):
+        for column in self._columns.values():
+            del column[:]
+        del self._input_bps[:]
+        del self._output_bps[:]
+        self._input_streams.clear()
+        self._output_streams.clear()
+        self._slots.clear()
+        self._free.clear()
+
+    def get(self, sid, name: str, default=0):
+        slot = self._slots.get(str(sid))
+        if slot is None:
+            return default
+        return self.value(slot, name)
+
+    def value(self, slot: int, name: str):
+        if name == StreamRuntimeFields.INPUT_STREAMS:
+            return self._input_streams[slot]
+        if name == StreamRuntimeFields.OUTPUT_STREAMS:
+            return self._output_streams[slot]
+        if name == StreamRuntimeTable.INPUT_BPS:
+            return self._input_bps[slot]
+        if name == StreamRuntimeTable.OUTPUT_BPS:
+            return self._output_bps[slot]
+        return self._columns[name][slot]
+
+    def to_front(self, slot: int) -> dict:
+        front = {name: column[slot] for name, column in self._columns.items()}
+        front[StreamRuntimeFields.INPUT_STREAMS] = self._input_streams[slot]
+        front[StreamRuntimeFields.OUTPUT_STREAMS] = self._output_streams[slot]
+        return front
+
+    # private
+    @staticmethod
+    def __total_bps(streams: list) -> int:
+        total = 0
+        for stream in streams:
+            try:
+                total += int(stream.get('bps', 0))
+            except (AttributeError, TypeError, ValueError, OverflowError):
+                continue
+        return min(total, StreamRuntimeTable.MAX_BPS)
+
+    def __clear(self, slot: int):
+        for column in self._columns.values():
+            column[slot] = 0
+        self._input_bps[slot] = 0
+        self._output_bps[slot] = 0
+        self._input_streams[slot] = []
+        self._output_streams[slot] = []
+
+
+class StreamRuntimeRow(object):
+    __slots__ = ['_table', '_slot']
+
+    def __init__(self, table: StreamRuntimeTable, slot: int):
+        self._table = table
+        self._slot = slot
+
+    @property
+    def status(self):
+        return self._table.value(self._slot, StreamRuntimeFields.STATUS)
+
+    @property
+    def cpu(self):
+        return self._table.value(self._slot, StreamRuntimeFields.CPU)
+
+    @property
+    def rss(self):
+        return self._table.value(self._slot, StreamRuntimeFields.RSS)
+
+    @property
+    def restarts(self):
+        return self._table.value(self._slot, StreamRuntimeFields.RESTARTS)
+
+    @property
+    def timestamp(self):
+        return self._table.value(self._slot, StreamRuntimeFields.TIMESTAMP)
+
+    @property
+    def input_bps(self):
+        return self._table.value(self._slot, StreamRuntimeTable.INPUT_BPS)
+
+    @property
+    def output_bps(self):
+        return self._table.value(self._slot, StreamRuntimeTable.OUTPUT_BPS)
+
+    def to_front(self) -> dict:
+        return self._table.to_front(self._slot)
@@ -0,0 +1,234 @@
+import codecs
+import csv
+import io
+import json
+import re
+
+from bson.objectid import ObjectId
+from gevent.threadpool import ThreadPool
+from mongoengine import ValidationError
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.common.service.entry import ServiceSettings
+from app.common.subscriber.entry import Subscriber
+from app.home.entry import user_cache
+from app.service.stream_importer import ImportResult
+
+
+class SubscriberFormat:
+    CSV = 'csv'
+    JSONL = 'jsonl'
+
+    ALL = [CSV, JSONL]
+
+    @staticmethod
+    def from_filename(filename: str, default=CSV) -> str:
+        extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+        return extension if extension in SubscriberFormat.ALL else default
+
+    @staticmethod
+    def mimetype(fmt: str) -> str:
+        return 'text/csv' if fmt == SubscriberFormat.CSV else 'application/x-ndjson'
+
+
+class SubscriberImporter(object):
+    DEFAULT_BATCH_SIZE = 1000
+    DEFAULT_HASH_WORKERS = 4
+    HASH_SAMPLE_PASSWORD = 'sample'
+    _hash_sample = None
+
+    def __init__(self, server_id: ObjectId, batch_size=DEFAULT_BATCH_SIZE, hash_workers=DEFAULT_HASH_WORKERS):
+        self._server_id = server_id
+        self._batch_size = batch_size
+        self._hash_workers = hash_workers
+
+    def import_file(self, stream, fmt: str) -> (ImportResult, list):
+        return self.insert(SubscriberImporter.read_rows(stream, fmt))
+
+    def insert(self, rows) -> (ImportResult, list):
+        result = ImportResult()
+        inserted = []
+        # password hashing is cpu bound, threads keep the hub free while it runs
+        pool = ThreadPool(self._hash_workers)
+        try:
+            batch = []
+            for row in rows:
+                entry = self.__make_entry(row)
+                if not entry:
+                    result.skipped += 1
+                    continue
+
+                batch.append(entry)
+                if len(batch) >= self._batch_size:
+                    inserted.extend(self.__insert_batch(batch, pool, result))
+                    batch = []
+            if batch:
+                inserted.extend(self.__insert_batch(batch, pool, result))
+        finally:
+            pool.kill()
+
+        if not inserted:
+            return result, inserted
+
+        try:
+            ServiceSettings._get_collection().update_one({'_id': self._server_id},
+                                                         {'$addToSet': {'subscribers': {'$each': inserted}}})
+        except PyMongoError as e:
+            print('Caught exception while attaching subscribers: {0}'.format(e))
+            Subscriber._get_collection().delete_many({'_id': {'$in': inserted}})
+            result.failed += len(inserted)
+            return result, []
+
+        user_cache.invalidate_server(self._server_id)
+        result.inserted += len(inserted)
+        return result, inserted
+
+    @staticmethod
+    def read_rows(stream, fmt: str):
+        # decode incrementally, the upload is never loaded as a whole
+        lines = codecs.iterdecode(stream, 'utf-8-sig')
+        if fmt == SubscriberFormat.JSONL:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row if isinstance(row, dict) else None
+        else:
+            yield from csv.DictReader(lines)
+
+    @staticmethod
+    def is_password_hash(value: str) -> bool:
+        # imported hashes must have the shape generate_password_hash produces: the same method, the same number of
+        # '$' separated fields and a hex digest of the same length
+        if not isinstance(value, str):
+            return False
+        if SubscriberImporter._hash_sample is None:
+            SubscriberImporter._hash_sample = Subscriber.generate_password_hash(SubscriberImporter.HASH_SAMPLE_PASSWORD)
+
+        sample = SubscriberImporter._hash_sample.split('$')
+        fields = value.split('$')
+        if len(fields) != len(sample):
+            return False
+
+        if len(sample) > 1:
+            # cost parameters like the iteration count may differ between versions, the method may not
+            method, sample_method = fields[0].split(':'), sample[0].split(':')
+            if len(method) != len(sample_method):
+                return False
+            for param, sample_param in zip(method, sample_method):
+                valid = param.isdigit() if sample_param.isdigit() else param == sample_param
+                if not valid:
+                    return False
+            if not all(field and not re.search(r'\s', field) for field in fields[1:-1]):
+                return False
+
+        return re.fullmatch('[0-9a-f]{{{0}}}'.format(len(sample[-1])), fields[-1]) is not None
+
+    # private
+    def __make_entry(self, row):
+        if not row:
+            return None
+
+        email = (row.get('email') or '').strip()
+        password = row.get('password') or ''
+        password_hash = row.get('password_hash') or ''
+        if not email or not (password or password_hash):
+            return None
+        if password_hash and not SubscriberImporter.is_password_hash(password_hash):
+            return None
+
+        entry = Subscriber(email=email, password=password_hash or password, servers=[self._server_id])
+        if row.get('country'):
+            entry.country = row['country'].strip()
+        if row.get('status') not in (None, ''):
+            try:
+                entry.status = int(row['status'])
+            except (TypeError, ValueError):
+                return None
+
+        try:
+            entry.validate()
+        except ValidationError:
+            return None
+
+        return entry, password if not password_hash else None
+
+    def __insert_batch(self, batch: list, pool: ThreadPool, result: ImportResult) -> list:
+        plain = [password for _, password in batch if password is not None]
+        hashes = iter(pool.map(Subscriber.generate_password_hash, plain))
+        docs = []
+        for entry, password in batch:
+            if password is not None:
+                entry.password = next(hashes)
+            docs.append(entry.to_mongo())
+
+        failed_indexes = set()
+        try:
+            Subscriber._get_collection().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = {error['index'] for error in e.details.get('writeErrors', [])}
+        except PyMongoError as e:
+            print('Caught exception while inserting subscribers: {0}'.format(e))
+            failed_indexes = set(range(len(docs)))
+
+        ids = []
+        for index, doc in enumerate(docs):
+            if index in failed_indexes or '_id' not in doc:
+                result.failed += 1
+                continue
+            ids.append(doc['_id'])
+        return ids
+
+
+class SubscriberExporter(object):
+    FIELDS = ['email', 'country', 'status', 'created_date']
+    HASH_FIELD = 'password_hash'
+    CURSOR_BATCH_SIZE = 1000
+
+    # password hashes end up in a downloadable file, they are only written when asked for
+    def __init__(self, server_id: ObjectId, include_hashes=False):
+        self._server_id = server_id
+        self._include_hashes = include_hashes
+
+    @property
+    def fields(self) -> list:
+        if self._include_hashes:
+            return SubscriberExporter.FIELDS[:1] + [SubscriberExporter.HASH_FIELD] + SubscriberExporter.FIELDS[1:]
+        return SubscriberExporter.FIELDS
+
+    def rows(self):
+        projection = {'email': 1, 'country': 1, 'status': 1, 'created_date': 1}
+        if self._include_hashes:
+            projection['password'] = 1
+        cursor = Subscriber._get_collection().find({'servers': self._server_id}, projection,
+                                                   batch_size=SubscriberExporter.CURSOR_BATCH_SIZE)
+        for doc in cursor:
+            created_date = doc.get('created_date')
+            row = {'email': doc.get('email'), 'country': doc.get('country'), 'status': doc.get('status'),
+                   'created_date': created_date.isoformat() if created_date else None}
+            if self._include_hashes:
+                row[SubscriberExporter.HASH_FIELD] = doc.get('password')
+            yield row
+
+    def generate(self, fmt: str):
+        if fmt == SubscriberFormat.JSONL:
+            for row in self.rows():
+                yield json.dumps(row) + '\n'
+            return
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.fields)
+        writer.writeheader()
+        count = 0
+        for row in self.rows():
+            writer.writerow(row)
+            count += 1
+            if count % SubscriberExporter.CURSOR_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -0,0 +1,151 @@
+import math
+import time
+from array import array
+
+
+class Resolution:
+    RAW = 'raw'
+    MINUTE = 'minute'
+    HOUR = 'hour'
+
+
+class RingBuffer(object):
+    __slots__ = ['_times', '_values', '_width', '_size', '_pos']
+
+    # one timestamp column shared by all metrics of an entity, values are stored row by row
+    def __init__(self, size: int, width: int):
+        self._times = array('I')
+        self._values = array('f')
+        self._width = width
+        self._size = size
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._times)
+
+    def append(self, timestamp: int, values):
+        if not self._size:
+            return
+
+        if len(self._times) < self._size:
+            self._times.append(timestamp)
+            self._values.extend(values)
+            return
+
+        self._times[self._pos] = timestamp
+        offset = self._pos * self._width
+        self._values[offset:offset + self._width] = array('f', values)
+        self._pos = (self._pos + 1) % self._size
+
+    def window(self, column: int, since=0) -> list:
+        count = len(self._times)
+        points = []
+        for i in range(count):
+            index = (self._pos + i) % count
+            timestamp = self._times[index]
+            value = self._values[index * self._width + column]
+            if timestamp >= since and not math.isnan(value):
+                points.append([timestamp, value])
+        return points
+
+
+class Bucket(object):
+    __slots__ = ['start', 'sums', 'counts']
+
+    def __init__(self, width: int):
+        self.start = 0
+        self.sums = [0.0] * width
+        self.counts = [0] * width
+
+    def is_empty(self) -> bool:
+        return not any(self.counts)
+
+    def averages(self) -> list:
+        return [total / count if count else math.nan for total, count in zip(self.sums, self.counts)]
+
+    def reset(self):
+        for i in range(len(self.sums)):
+            self.sums[i] = 0.0
+            self.counts[i] = 0
+
+
+class EntitySeries(object):
+    __slots__ = ['_levels', '_buckets']
+
+    LEVELS = ((Resolution.RAW, 0), (Resolution.MINUTE, 60), (Resolution.HOUR, 3600))
+
+    def __init__(self, width: int, sizes: dict):
+        self._levels = {name: RingBuffer(sizes[name], width) for name, _ in EntitySeries.LEVELS}
+        self._buckets = {name: Bucket(width) for name, step in EntitySeries.LEVELS if step}
+
+    def append(self, timestamp: int, values: list):
+        self._levels[Resolution.RAW].append(timestamp, values)
+        for name, step in EntitySeries.LEVELS:
+            if not step:
+                continue
+
+            bucket = self._buckets[name]
+            start = timestamp - timestamp % step
+            if bucket.start != start and not bucket.is_empty():
+                self._levels[name].append(bucket.start, bucket.averages())
+                bucket.reset()
+            bucket.start = start
+            for i, value in enumerate(values):
+                if not math.isnan(value):
+                    bucket.sums[i] += value
+                    bucket.counts[i] += 1
+
+    def window(self, column: int, resolution: str, since=0) -> list:
+        ring = self._levels.get(resolution)
+        if ring is None:
+            return []
+
+        points = ring.window(column, since)
+        bucket = self._buckets.get(resolution)
+        if bucket and bucket.counts[column] and bucket.start >= since:
+            points.append([bucket.start, bucket.sums[column] / bucket.counts[column]])
+        return points
+
+
+class TimeSeriesStore(object):
+    # samples cost 4 + 4 * len(metrics) bytes: a stream with its five metrics holds 168 samples * 24 B, about
+    # 6 KiB once full including the object overhead (~60 MB for 10k streams)
+    STREAM_SIZES = {Resolution.RAW: 60, Resolution.MINUTE: 60, Resolution.HOUR: 48}
+    SERVICE_SIZES = {Resolution.RAW: 360, Resolution.MINUTE: 1440, Resolution.HOUR: 720}
+    DEFAULT_SIZES = STREAM_SIZES
+
+    def __init__(self, metrics: list, sizes: dict = None):
+        self._metrics = list(metrics)
+        self._columns = {metric: column for column, metric in enumerate(self._metrics)}
+        self._sizes = sizes or TimeSeriesStore.DEFAULT_SIZES
+        self._entities = {}
+
+    def add(self, entity: str, metrics: dict, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        values = []
+        for metric in self._metrics:
+            value = metrics.get(metric)
+            values.append(float(value) if isinstance(value, (int, float)) else math.nan)
+        if all(math.isnan(value) for value in values):
+            return
+
+        series = self._entities.get(entity)
+        if not series:
+            series = EntitySeries(len(self._metrics), self._sizes)
+            self._entities[entity] = series
+        series.append(timestamp, values)
+
+    def window(self, entity: str, metric: str, resolution=Resolution.RAW, since=0) -> list:
+        series = self._entities.get(entity)
+        column = self._columns.get(metric)
+        if not series or column is None:
+            return []
+        return series.window(column, resolution, since)
+
+    def metrics(self, entity: str) -> list:
+        return list(self._metrics) if entity in self._entities else []
+
+    def remove(self, entity: str):
+        self._entities.pop(entity, None)
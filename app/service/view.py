@@ -1,18 +1,21 @@
-import os
-
 from flask_classy import FlaskView, route
-from flask import render_template, redirect, url_for, request, jsonify, Response
+from flask import render_template, redirect, url_for, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 
-from app import get_runtime_folder
+from app import app, get_runtime_folder, import_manager, playlist_cache, servers_manager
 from app.common.service.forms import ServiceSettingsForm, ActivateForm, UploadM3uForm, ServerProviderForm
 from app.common.subscriber.forms import SignupForm
 from app.common.service.entry import ServiceSettings, ProviderPair
 from app.common.subscriber.entry import Subscriber
-from app.common.utils.m3u_parser import M3uParser
-from app.common.utils.utils import is_valid_http_url
 from app.home.entry import ProviderUser
-import app.common.constants as constants
+from app.service.membership import Membership
+from app.service.playlist_cache import PlaylistCache
+from app.service.timeseries import Resolution
+from app.service.log_store import LogStore, LogTooLargeError
+from app.service.log_responses import tail_response, range_response, search_response, download_response
+from app.service.subscriber_transfer import SubscriberFormat, SubscriberImporter, SubscriberExporter
+
+service_logs = LogStore(get_runtime_folder(), app.config.get('LOG_UPLOAD_MAX_SIZE', LogStore.DEFAULT_MAX_SIZE))
 
 
 # routes
@@ -22,11 +25,43 @@ class ServiceView(FlaskView):
     def default_logo_url(self):
         return url_for('static', filename='images/unknown_channel.png', _external=True)
 
+    @staticmethod
+    def _playlist_keys(server: ServiceSettings) -> list:
+        # raw ids, dereferencing every stream document just for its key is not needed
+        stream_ids = server.to_mongo().get('streams', [])
+        return [PlaylistCache.service_key(server.id)] + [PlaylistCache.stream_key(sid) for sid in stream_ids]
+
+    @staticmethod
+    def _find_own_job(jid: str):
+        job = import_manager.find_job(jid)
+        server = current_user.get_current_server()
+        if job and server and job.server.id == server.id:
+            return job
+        return None
+
+    @staticmethod
+    def _find_own_server(sid: str):
+        # only services the current provider belongs to, together with its role there
+        server = ServiceSettings.objects(id=sid, providers__user=current_user.id).only('id', 'providers').first()
+        if not server:
+            return None, None
+
+        for pair in server.to_mongo().get('providers', []):
+            user = pair.get('user')
+            # references are stored as ObjectId or DBRef
+            if getattr(user, 'id', user) == current_user.id:
+                return server, pair.get('role')
+        return None, None
+
     @login_required
     @route('/upload_m3u', methods=['POST', 'GET'])
     def upload_m3u(self):
         form = UploadM3uForm()
-        return render_template('service/upload_m3u.html', form=form)
+        jobs = []
+        server = current_user.get_current_server()
+        if server:
+            jobs = [job.to_dict() for job in import_manager.get_jobs(server)]
+        return render_template('service/upload_m3u.html', form=form, jobs=jobs)
 
     @login_required
     @route('/upload_file', methods=['POST'])
@@ -34,77 +69,31 @@ class ServiceView(FlaskView):
         form = UploadM3uForm()
         server = current_user.get_current_server()
         if server and form.validate_on_submit():
-            stream_type = form.type.data
-            file_handle = form.file.data
-            tags = form.tags.data
-            m3u_parser = M3uParser()
-            m3u_parser.load_content(file_handle.read().decode('utf-8'))
-            m3u_parser.parse()
-
-            streams = []
-            default_logo_path = self.default_logo_url()
-            for file in m3u_parser.files:
-                if stream_type == constants.StreamType.PROXY:
-                    stream = server.make_proxy_stream()
-                elif stream_type == constants.StreamType.RELAY:
-                    stream = server.make_relay_stream()
-                    stream.output.urls[0] = stream.generate_http_link()
-                elif stream_type == constants.StreamType.ENCODE:
-                    stream = server.make_encode_stream()
-                    stream.output.urls[0] = stream.generate_http_link()
-                elif stream_type == constants.StreamType.VOD_RELAY:
-                    stream = server.make_vod_relay_stream()
-                    stream.output.urls[0] = stream.generate_vod_link()
-                elif stream_type == constants.StreamType.VOD_ENCODE:
-                    stream = server.make_vod_encode_stream()
-                    stream.output.urls[0] = stream.generate_vod_link()
-                elif stream_type == constants.StreamType.COD_RELAY:
-                    stream = server.make_cod_relay_stream()
-                    stream.output.urls[0] = stream.generate_cod_link()
-                elif stream_type == constants.StreamType.COD_ENCODE:
-                    stream = server.make_cod_encode_stream()
-                    stream.output.urls[0] = stream.generate_cod_link()
-                elif stream_type == constants.StreamType.CATCHUP:
-                    stream = server.make_catchup_stream()
-                else:
-                    stream = server.make_test_life_stream()
-
-                input_url = file['link']
-                if stream_type == constants.StreamType.PROXY:
-                    stream.output.urls[0].uri = input_url
-                else:
-                    stream.input.urls[0].uri = input_url
-
-                stream.tvg_logo = default_logo_path
-                stream.tags = tags
-
-                title = file['title']
-                if len(title) < constants.MAX_STREAM_NAME_LENGTH:
-                    stream.name = title
-
-                tvg_id = file['tvg-id']
-                if len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
-                    stream.tvg_id = tvg_id
-
-                tvg_name = file['tvg-name']
-                if len(tvg_name) < constants.MAX_STREAM_NAME_LENGTH:
-                    stream.tvg_name = tvg_name
-
-                tvg_group = file['tvg-group']
-                if len(tvg_group) < constants.MAX_STREAM_GROUP_TITLE_LENGTH:
-                    stream.group_title = tvg_group
-
-                tvg_logo = file['tvg-logo']
-                if len(tvg_logo) < constants.MAX_URL_LENGTH:
-                    if is_valid_http_url(tvg_logo, timeout=0.1):
-                        stream.tvg_logo = tvg_logo
-                stream.save()
-                streams.append(stream)
-
-            server.add_streams(streams)
+            path = import_manager.upload_path()
+            form.file.data.save(path)
+            import_manager.start(path, server, form.type.data, form.tags.data, self.default_logo_url())
+            return redirect(url_for('ServiceView:upload_m3u'))
 
         return redirect(url_for('ProviderView:dashboard'))
 
+    @login_required
+    @route('/import/<jid>', methods=['GET'])
+    def import_progress(self, jid):
+        job = ServiceView._find_own_job(jid)
+        if job:
+            return jsonify(status='ok', job=job.to_dict()), 200
+
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/import/resume/<jid>', methods=['POST'])
+    def import_resume(self, jid):
+        if ServiceView._find_own_job(jid):
+            job = import_manager.resume(jid)
+            return jsonify(status='ok', job=job.to_dict()), 200
+
+        return jsonify(status='failed'), 404
+
     @login_required
     def connect(self):
         server = current_user.get_current_server()
@@ -119,6 +108,15 @@ class ServiceView(FlaskView):
             server.disconnect()
         return redirect(url_for('ProviderView:dashboard'))
 
+    @login_required
+    @route('/connections', methods=['GET'])
+    def connections(self):
+        states = servers_manager.connection_states()
+        result = {}
+        for server in current_user.servers:
+            result[str(server.id)] = states.get(str(server.id))
+        return jsonify(status='ok', connections=result), 200
+
     @route('/activate', methods=['POST', 'GET'])
     @login_required
     def activate(self):
@@ -137,7 +135,7 @@ class ServiceView(FlaskView):
     def sync(self):
         server = current_user.get_current_server()
         if server:
-            server.sync()
+            server.sync(full=True)
         return redirect(url_for('ProviderView:dashboard'))
 
     @login_required
@@ -164,9 +162,25 @@ class ServiceView(FlaskView):
     @login_required
     @route('/playlist/<sid>/master.m3u', methods=['GET'])
     def playlist(self, sid):
-        server = ServiceSettings.objects(id=sid).first()
+        def generate():
+            server = ServiceSettings.objects(id=sid).first()
+            return server.generate_playlist() if server else None
+
+        entry = playlist_cache.get_or_generate(PlaylistCache.service_key(sid), generate)
+        if entry:
+            return PlaylistCache.make_response(entry, request)
+
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/stats/<metric>', methods=['GET'])
+    def stats(self, metric):
+        server = current_user.get_current_server()
         if server:
-            return Response(server.generate_playlist(), mimetype='application/x-mpequrl'), 200
+            resolution = request.args.get('resolution', Resolution.RAW)
+            since = request.args.get('since', 0, type=int)
+            points = server.get_service_timeseries(metric, resolution, since)
+            return jsonify(status='ok', metric=metric, resolution=resolution, points=points), 200
 
         return jsonify(status='failed'), 404
 
@@ -174,17 +188,46 @@ class ServiceView(FlaskView):
     def view_log(self):
         server = current_user.get_current_server()
         if server:
-            path = os.path.join(get_runtime_folder(), str(server.id))
             try:
-                with open(path, "r") as f:
-                    content = f.read()
-
-                return content
+                content = service_logs.tail(str(server.id), LogStore.DEFAULT_TAIL_LINES)
+                return b'<pre>' + content + b'</pre>'
             except OSError as e:
                 print('Caught exception OSError : {0}'.format(e))
                 return '''<pre>Not found, please use get log button firstly.</pre>'''
         return '''<pre>Not found, please create server firstly.</pre>'''
 
+    @login_required
+    @route('/log/tail', methods=['GET'])
+    def log_tail(self):
+        server = current_user.get_current_server()
+        if server and service_logs.exists(str(server.id)):
+            return tail_response(service_logs, str(server.id), request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/range', methods=['GET'])
+    def log_range(self):
+        server = current_user.get_current_server()
+        if server and service_logs.exists(str(server.id)):
+            return range_response(service_logs, str(server.id), request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/search', methods=['GET'])
+    def log_search(self):
+        server = current_user.get_current_server()
+        if server and service_logs.exists(str(server.id)):
+            return search_response(service_logs, str(server.id), request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/download', methods=['GET'])
+    def log_download(self):
+        server = current_user.get_current_server()
+        if server and service_logs.exists(str(server.id)):
+            return download_response(service_logs, str(server.id), request)
+        return jsonify(status='failed'), 404
+
     # broadcast routes
 
     @login_required
@@ -200,12 +243,11 @@ class ServiceView(FlaskView):
     def provider_add(self, sid):
         form = ServerProviderForm()
         if request.method == 'POST' and form.validate_on_submit():
-            provider = ProviderUser.objects(email=form.email.data).first()
-            server = ServiceSettings.objects(id=sid).first()
+            provider = ProviderUser.objects(email=form.email.data).only('id').first()
+            server = ServiceSettings.objects(id=sid).only('id').first()
             if server and provider:
-                admin = ProviderPair(provider.id, form.role.data)
-                server.add_provider(admin)
-                provider.add_server(server)
+                Membership.add_provider(server.id, provider.id, form.role.data)
+                servers_manager.reload_providers(server.id)
                 return jsonify(status='ok'), 200
 
         return render_template('service/provider/add.html', form=form)
@@ -215,11 +257,11 @@ class ServiceView(FlaskView):
     def provider_remove(self, sid):
         data = request.get_json()
         pid = data['pid']
-        provider = ProviderUser.objects(id=pid).first()
-        server = ServiceSettings.objects(id=sid).first()
+        provider = ProviderUser.objects(id=pid).only('id').first()
+        server = ServiceSettings.objects(id=sid).only('id').first()
         if provider and server:
-            server.remove_provider(provider)
-            provider.remove_server(server)
+            Membership.remove_provider(server.id, provider.id)
+            servers_manager.reload_providers(server.id)
             return jsonify(status='ok'), 200
 
         return jsonify(status='failed'), 404
@@ -237,16 +279,54 @@ class ServiceView(FlaskView):
     def subscriber_add(self, sid):
         form = SignupForm()
         if request.method == 'POST' and form.validate_on_submit():
-            server = ServiceSettings.objects(id=sid).first()
+            server = ServiceSettings.objects(id=sid).only('id').first()
             if server:
                 new_entry = form.make_entry()
-                new_entry.add_server(server)
-
-                server.add_subscriber(new_entry)
+                new_entry.save()
+                Membership.add_subscriber(server.id, new_entry.id)
+                servers_manager.refresh_subscribers(server.id, added=[new_entry.id])
                 return jsonify(status='ok'), 200
 
         return render_template('service/subscriber/add.html', form=form)
 
+    @login_required
+    @route('/subscriber/import/<sid>', methods=['POST'])
+    def subscriber_import(self, sid):
+        file = request.files.get('file')
+        server, _ = ServiceView._find_own_server(sid)
+        if server and file:
+            fmt = request.form.get('format') or SubscriberFormat.from_filename(file.filename)
+            if fmt not in SubscriberFormat.ALL:
+                return jsonify(status='failed', error='unknown format'), 400
+
+            importer = SubscriberImporter(server.id,
+                                          app.config.get('SUBSCRIBER_IMPORT_BATCH_SIZE',
+                                                         SubscriberImporter.DEFAULT_BATCH_SIZE),
+                                          app.config.get('SUBSCRIBER_IMPORT_HASH_WORKERS',
+                                                         SubscriberImporter.DEFAULT_HASH_WORKERS))
+            result, inserted = importer.import_file(file.stream, fmt)
+            servers_manager.refresh_subscribers(server.id, added=inserted)
+            return jsonify(status='ok', **result.to_dict()), 200
+
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/subscriber/export/<sid>', methods=['GET'])
+    def subscriber_export(self, sid):
+        fmt = request.args.get('format', SubscriberFormat.CSV)
+        include_hashes = request.args.get('include_hashes', 0, type=int) != 0
+        server, role = ServiceView._find_own_server(sid)
+        if server and fmt in SubscriberFormat.ALL:
+            if include_hashes and role != ProviderPair.Roles.ADMIN:
+                return jsonify(status='failed', error='password hashes require the admin role'), 403
+
+            exporter = SubscriberExporter(server.id, include_hashes)
+            filename = 'subscribers_{0}.{1}'.format(sid, fmt)
+            return Response(stream_with_context(exporter.generate(fmt)), mimetype=SubscriberFormat.mimetype(fmt),
+                            headers={'Content-Disposition': 'attachment; filename={0}'.format(filename)})
+
+        return jsonify(status='failed'), 404
+
     @login_required
     @route('/subscriber/edit/<sid>', methods=['GET', 'POST'])
     def subscriber_edit(self, sid):
@@ -255,6 +335,8 @@ class ServiceView(FlaskView):
         if request.method == 'POST' and form.validate_on_submit():
             subscriber = form.update_entry(subscriber)
             subscriber.save()
+            for server_id in subscriber.to_mongo().get('servers', []):
+                servers_manager.refresh_subscribers(server_id, added=[subscriber.id])
             return jsonify(status='ok'), 200
 
         return render_template('service/subscriber/edit.html', form=form)
@@ -266,7 +348,10 @@ class ServiceView(FlaskView):
         sid = data['sid']
         subscriber = Subscriber.objects(id=sid).first()
         if subscriber:
+            server_ids = Membership.remove_subscriber_everywhere(subscriber.id)
             subscriber.delete()
+            for server_id in server_ids:
+                servers_manager.refresh_subscribers(server_id, removed=[subscriber.id])
             return jsonify(status='ok'), 200
 
         return jsonify(status='failed'), 404
@@ -277,9 +362,8 @@ class ServiceView(FlaskView):
         form = ServiceSettingsForm(obj=ServiceSettings())
         if request.method == 'POST' and form.validate_on_submit():
             new_entry = form.make_entry()
-            admin = ProviderPair(current_user.id, ProviderPair.Roles.ADMIN)
-            new_entry.add_provider(admin)
-            current_user.add_server(new_entry)
+            new_entry.save()
+            Membership.add_provider(new_entry.id, current_user.id, ProviderPair.Roles.ADMIN)
             return jsonify(status='ok'), 200
 
         return render_template('service/add.html', form=form)
@@ -290,7 +374,9 @@ class ServiceView(FlaskView):
         sid = request.form['sid']
         server = ServiceSettings.objects(id=sid).first()
         if server:
+            keys = ServiceView._playlist_keys(server)
             server.delete()
+            playlist_cache.forget(keys)
             return jsonify(status='ok'), 200
 
         return jsonify(status='failed'), 404
@@ -304,18 +390,18 @@ class ServiceView(FlaskView):
         if request.method == 'POST' and form.validate_on_submit():
             server = form.update_entry(server)
             server.save()
+            servers_manager.reload_settings(server.id)
+            # stream playlists embed the service hosts too
+            playlist_cache.invalidate_many(ServiceView._playlist_keys(server))
             return jsonify(status='ok'), 200
 
         return render_template('service/edit.html', form=form)
 
     @route('/log/<sid>', methods=['POST'])
     def log(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_folder(), sid)
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(b'<pre>')
-            f.write(data)
-            f.write(b'</pre>')
-            f.close()
+        try:
+            service_logs.ingest(sid, request.stream, request.content_length)
+        except LogTooLargeError as e:
+            return jsonify(status='failed', error=str(e)), 413
+
         return jsonify(status='ok'), 200
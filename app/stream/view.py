@@ -1,20 +1,28 @@
-import os
-
 from flask_classy import FlaskView, route
-from flask import render_template, request, jsonify, Response
+from flask import render_template, request, jsonify
 from flask_login import login_required, current_user
 
 import app.common.constants as constants
-from app import get_runtime_stream_folder
+from app import app, get_runtime_stream_folder, playlist_cache
 from app.common.stream.entry import IStream
+from app.service.playlist_cache import PlaylistCache
+from app.service.service import StreamControl
+from app.service.timeseries import Resolution
+from app.service.stream_listing import StreamListing
+from app.service.rpc import rpc_status
+from app.service.log_store import LogStore, LogTooLargeError
+from app.service.log_responses import tail_response, range_response, search_response, download_response
 from app.common.stream.forms import ProxyStreamForm, EncodeStreamForm, RelayStreamForm, TimeshiftRecorderStreamForm, \
     CatchupStreamForm, TimeshiftPlayerStreamForm, TestLifeStreamForm, VodEncodeStreamForm, VodRelayStreamForm, \
     CodEncodeStreamForm, CodRelayStreamForm
 
+stream_logs = LogStore(get_runtime_stream_folder(), app.config.get('LOG_UPLOAD_MAX_SIZE', LogStore.DEFAULT_MAX_SIZE))
+
 
 # routes
 class StreamView(FlaskView):
     DEFAULT_PIPELINE_FILENAME_TEMPLATE_1S = '{0}_pipeline.html'
+    RPC_TIMEOUT = 5
 
     route_base = "/stream/"
 
@@ -29,9 +37,8 @@ class StreamView(FlaskView):
         if server:
             data = request.get_json()
             sids = data['sids']
-            for sid in sids:
-                server.start_stream(sid)
-            return jsonify(status='ok'), 200
+            results = server.control_streams(StreamControl.START, sids)
+            return jsonify(status='ok', results=results), 200
         return jsonify(status='failed'), 404
 
     @login_required
@@ -41,9 +48,8 @@ class StreamView(FlaskView):
         if server:
             data = request.get_json()
             sids = data['sids']
-            for sid in sids:
-                server.stop_stream(sid)
-            return jsonify(status='ok'), 200
+            results = server.control_streams(StreamControl.STOP, sids)
+            return jsonify(status='ok', results=results), 200
         return jsonify(status='failed'), 404
 
     @login_required
@@ -53,17 +59,49 @@ class StreamView(FlaskView):
         if server:
             data = request.get_json()
             sids = data['sids']
-            for sid in sids:
-                server.restart_stream(sid)
-            return jsonify(status='ok'), 200
+            results = server.control_streams(StreamControl.RESTART, sids)
+            return jsonify(status='ok', results=results), 200
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/list', methods=['GET'])
+    def list_streams(self):
+        server = current_user.get_current_server()
+        if server:
+            sort = request.args.get('sort', 'name')
+            if not StreamListing.is_valid_cursor(request.args.get('cursor'), sort):
+                return jsonify(status='failed', error='invalid cursor'), 400
+
+            page = server.list_streams(kind=request.args.get('kind'), sort=sort,
+                                       order=request.args.get('order', 'asc'), name=request.args.get('name'),
+                                       tag=request.args.get('tag'), group=request.args.get('group'),
+                                       cursor=request.args.get('cursor'),
+                                       limit=request.args.get('limit', StreamListing.DEFAULT_LIMIT, type=int))
+            return jsonify(status='ok', **page), 200
         return jsonify(status='failed'), 404
 
     @login_required
     @route('/play/<sid>/master.m3u', methods=['GET'])
     def play(self, sid):
-        stream = IStream.objects(id=sid).first()
-        if stream:
-            return Response(stream.generate_playlist(), mimetype='application/x-mpequrl'), 200
+        def generate():
+            stream = IStream.objects(id=sid).first()
+            return stream.generate_playlist() if stream else None
+
+        entry = playlist_cache.get_or_generate(PlaylistCache.stream_key(sid), generate)
+        if entry:
+            return PlaylistCache.make_response(entry, request)
+
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/stats/<sid>/<metric>', methods=['GET'])
+    def stats(self, sid, metric):
+        server = current_user.get_current_server()
+        if server:
+            resolution = request.args.get('resolution', Resolution.RAW)
+            since = request.args.get('since', 0, type=int)
+            points = server.get_stream_timeseries(sid, metric, resolution, since)
+            return jsonify(status='ok', metric=metric, resolution=resolution, points=points), 200
 
         return jsonify(status='failed'), 404
 
@@ -73,8 +111,8 @@ class StreamView(FlaskView):
         server = current_user.get_current_server()
         if server:
             sid = request.form['sid']
-            server.get_log_stream(sid)
-            return jsonify(status='ok'), 200
+            result = rpc_status(server.get_log_stream(sid), StreamView.RPC_TIMEOUT)
+            return jsonify(**result), 200
         return jsonify(status='failed'), 404
 
     @login_required
@@ -83,32 +121,87 @@ class StreamView(FlaskView):
         server = current_user.get_current_server()
         if server:
             sid = request.form['sid']
-            server.get_pipeline_stream(sid)
-            return jsonify(status='ok'), 200
+            result = rpc_status(server.get_pipeline_stream(sid), StreamView.RPC_TIMEOUT)
+            return jsonify(**result), 200
         return jsonify(status='failed'), 404
 
     @login_required
     def view_log(self, sid):
-        path = os.path.join(get_runtime_stream_folder(), sid)
         try:
-            with open(path, "r") as f:
-                content = f.read()
-                return content
+            content = stream_logs.tail(sid, LogStore.DEFAULT_TAIL_LINES)
+            return b'<pre>' + content + b'</pre>'
         except OSError as e:
             print('Caught exception OSError : {0}'.format(e))
             return '''<pre>Not found, please use get log button firstly.</pre>'''
 
     @login_required
     def view_pipeline(self, sid):
-        path = os.path.join(get_runtime_stream_folder(), StreamView._get_pipeline_name(sid))
         try:
-            with open(path, "r") as f:
-                content = f.read()
-                return content
+            return stream_logs.tail(StreamView._get_pipeline_name(sid), LogStore.DEFAULT_TAIL_LINES)
         except OSError as e:
             print('Caught exception OSError : {0}'.format(e))
             return '''<pre>Not found, please use get pipeline button firstly.</pre>'''
 
+    @login_required
+    @route('/log/<sid>/tail', methods=['GET'])
+    def log_tail(self, sid):
+        if stream_logs.exists(sid):
+            return tail_response(stream_logs, sid, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/<sid>/range', methods=['GET'])
+    def log_range(self, sid):
+        if stream_logs.exists(sid):
+            return range_response(stream_logs, sid, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/<sid>/search', methods=['GET'])
+    def log_search(self, sid):
+        if stream_logs.exists(sid):
+            return search_response(stream_logs, sid, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/log/<sid>/download', methods=['GET'])
+    def log_download(self, sid):
+        if stream_logs.exists(sid):
+            return download_response(stream_logs, sid, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/pipeline/<sid>/tail', methods=['GET'])
+    def pipeline_tail(self, sid):
+        name = StreamView._get_pipeline_name(sid)
+        if stream_logs.exists(name):
+            return tail_response(stream_logs, name, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/pipeline/<sid>/range', methods=['GET'])
+    def pipeline_range(self, sid):
+        name = StreamView._get_pipeline_name(sid)
+        if stream_logs.exists(name):
+            return range_response(stream_logs, name, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/pipeline/<sid>/search', methods=['GET'])
+    def pipeline_search(self, sid):
+        name = StreamView._get_pipeline_name(sid)
+        if stream_logs.exists(name):
+            return search_response(stream_logs, name, request)
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/pipeline/<sid>/download', methods=['GET'])
+    def pipeline_download(self, sid):
+        name = StreamView._get_pipeline_name(sid)
+        if stream_logs.exists(name):
+            return download_response(stream_logs, name, request)
+        return jsonify(status='failed'), 404
+
     # broadcast routes
 
     @login_required
@@ -435,24 +528,18 @@ class StreamView(FlaskView):
 
     @route('/log/<sid>', methods=['POST'])
     def log(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_stream_folder(), sid)
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(b'<pre>')
-            f.write(data)
-            f.write(b'</pre>')
-            f.close()
+        try:
+            stream_logs.ingest(sid, request.stream, request.content_length)
+        except LogTooLargeError as e:
+            return jsonify(status='failed', error=str(e)), 413
 
         return jsonify(status='ok'), 200
 
     @route('/pipeline/<sid>', methods=['POST'])
     def pipeline(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_stream_folder(), StreamView._get_pipeline_name(sid))
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(data)
-            f.close()
+        try:
+            stream_logs.ingest(StreamView._get_pipeline_name(sid), request.stream, request.content_length)
+        except LogTooLargeError as e:
+            return jsonify(status='failed', error=str(e)), 413
 
         return jsonify(status='ok'), 200
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# server.py and service_daemon.py run unpatched, so does the benchmark unless --monkey_patch is given. the flag
+# has to be checked before anything imports socket or pymongo
+MONKEY_PATCH = '--monkey_patch' in sys.argv
+if MONKEY_PATCH:
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import gevent
+from mongoengine import connect
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.common.service.entry import ServiceSettings
+from app.common.stream.entry import IStream, TestLifeStream
+from app.service.service_manager import ServiceManager
+from app.service.service_client import ServiceClient
+from app.service.stream_importer import StreamImporter
+from app.metrics.metrics import RECV_BATCH_FRAMES
+
+PROJECT_NAME = 'benchmark'
+SIMULATOR_PATH = os.path.join(os.path.dirname(__file__), 'fastocloud_sim.py')
+
+
+class EmitCounter(object):
+    __slots__ = ['emits', 'items', 'bytes']
+
+    def __init__(self):
+        self.emits = 0
+        self.items = 0
+        self.bytes = 0
+
+    # stands in for the socketio server and an attached browser, every frame is acked on the next loop turn
+    def emit(self, channel: str, data, room=None, callback=None):
+        self.emits += 1
+        self.items += len(data.get('items', [])) if isinstance(data, dict) else len(data)
+        self.bytes += len(json.dumps(data, default=str))
+        if callback:
+            gevent.spawn(callback)
+
+
+class LoopLagProbe(object):
+    __slots__ = ['interval', 'samples', 'max']
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = []
+        self.max = 0.0
+
+    def run(self):
+        while True:
+            start = time.monotonic()
+            gevent.sleep(self.interval)
+            lag = time.monotonic() - start - self.interval
+            self.samples.append(lag)
+            if lag > self.max:
+                self.max = lag
+
+    def reset(self):
+        self.samples = []
+        self.max = 0.0
+
+    def percentile(self, value: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * value))]
+
+
+def create_services(host: str, port: int, nodes: int, streams: int) -> list:
+    services = []
+    for i in range(nodes):
+        settings = ServiceSettings(name='{0}_{1}'.format(PROJECT_NAME, i))
+        settings.host.host = host
+        settings.host.port = port + i
+        settings.save()
+
+        importer = StreamImporter(settings)
+        batch = []
+        for j in range(streams):
+            stream = TestLifeStream.make_stream(settings)
+            stream.name = '{0}_{1}_{2}'.format(PROJECT_NAME, i, j)
+            batch.append(stream)
+        result, _ = importer.insert(batch)
+        print('Created service {0}:{1}, {2}'.format(host, port + i, result))
+        services.append(settings.reload())
+    return services
+
+
+def remove_services(services: list):
+    for settings in services:
+        IStream.objects(id__in=[stream.id for stream in settings.streams]).delete()
+        settings.delete()
+
+
+def frames_per_wakeup() -> float:
+    samples = {name: value for name, _, value in RECV_BATCH_FRAMES.samples()}
+    count = samples.get(RECV_BATCH_FRAMES.name + '_count', 0)
+    return samples.get(RECV_BATCH_FRAMES.name + '_sum', 0) / count if count else 0.0
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
+    parser.add_argument('--mongo_uri', help='MongoDB credentials', default='mongodb://localhost:27017/iptv_bench')
+    parser.add_argument('--host', help='simulated nodes host (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--port', help='first simulated node port (default: 6317)', type=int, default=6317)
+    parser.add_argument('--nodes', help='number of services (default: 1)', type=int, default=1)
+    parser.add_argument('--streams', help='streams per service (default: 1000)', type=int, default=1000)
+    parser.add_argument('--stream_rate', help='statistic messages per stream per second (default: 1)', type=float,
+                        default=1.0)
+    parser.add_argument('--emit_window', help='socketio coalescing window in msec (default: 250)', type=int,
+                        default=250)
+    parser.add_argument('--burst', help='nodes send statistics of all streams back to back', action='store_true')
+    parser.add_argument('--receive', help='socket receive path (default: batched)', choices=['batched', 'single'],
+                        default='batched')
+    parser.add_argument('--warmup', help='seconds before measuring (default: 5)', type=float, default=5)
+    parser.add_argument('--duration', help='measured seconds (default: 30)', type=float, default=30)
+    parser.add_argument('--external_nodes', help='do not spawn the simulator, nodes are already running',
+                        action='store_true')
+    parser.add_argument('--keep', help='keep the created services and streams in the database', action='store_true')
+    parser.add_argument('--monkey_patch', help='run with gevent monkey patching, the servers run without it',
+                        action='store_true')
+
+    argv = parser.parse_args()
+
+    mongo = connect(host=argv.mongo_uri)
+    if not mongo:
+        sys.exit(1)
+
+    ServiceClient.BATCHED_RECEIVE = argv.receive == 'batched'
+    simulator = None
+    if not argv.external_nodes:
+        simulator_args = [sys.executable, SIMULATOR_PATH, '--host', argv.host, '--port', str(argv.port), '--nodes',
+                          str(argv.nodes), '--stream_rate', str(argv.stream_rate)]
+        if argv.burst:
+            simulator_args.append('--burst')
+        simulator = subprocess.Popen(simulator_args)
+        gevent.sleep(1)
+
+    services = create_services(argv.host, argv.port, argv.nodes, argv.streams)
+    socketio = EmitCounter()
+    manager = ServiceManager(argv.host, 0, socketio, argv.emit_window)
+    probe = LoopLagProbe(0.05)
+    workers = [gevent.spawn(manager.refresh), gevent.spawn(probe.run)]
+    try:
+        for settings in services:
+            server = manager.find_or_create_server(settings)
+            server.connect()
+            server.activate(PROJECT_NAME)
+            # frames are only emitted to attached clients, simulate one dashboard per service
+            manager.attach_client('{0}_{1}'.format(PROJECT_NAME, settings.id), str(settings.id))
+
+        gevent.sleep(argv.warmup)
+        start_stats = manager.loop_stats()
+        start_emits, start_items, start_bytes = socketio.emits, socketio.items, socketio.bytes
+        probe.reset()
+        start = time.monotonic()
+        gevent.sleep(argv.duration)
+        elapsed = time.monotonic() - start
+
+        stats = manager.loop_stats()
+        dispatched = stats['dispatched'] - start_stats['dispatched']
+        print('services: {0}, connected: {1}, streams per service: {2}, receive: {3}, monkey patched: {4}'.format(
+            stats['services'], stats['connected'], argv.streams, argv.receive, MONKEY_PATCH))
+        print('dispatched reads: {0:.1f}/s, dispatch avg: {1:.3f} ms, max: {2:.3f} ms'.format(
+            dispatched / elapsed, stats['dispatch_time_avg'] * 1000, stats['dispatch_time_max'] * 1000))
+        if ServiceClient.BATCHED_RECEIVE:
+            print('frames per wakeup: {0:.1f}'.format(frames_per_wakeup()))
+        print('loop lag p50: {0:.3f} ms, p99: {1:.3f} ms, max: {2:.3f} ms'.format(
+            probe.percentile(0.5) * 1000, probe.percentile(0.99) * 1000, probe.max * 1000))
+        print('emits: {0:.1f}/s, items: {1:.1f}/s, payload: {2:.1f} KiB/s'.format(
+            (socketio.emits - start_emits) / elapsed, (socketio.items - start_items) / elapsed,
+            (socketio.bytes - start_bytes) / elapsed / 1024))
+        clients = manager.client_stats().values()
+        print('client queue depth max: {0}, dropped: {1}'.format(max([client['depth'] for client in clients] or [0]),
+                                                                sum(client['dropped'] for client in clients)))
+        print('max rss: {0:.1f} MiB'.format(max_rss_mb()))
+    finally:
+        manager.stop()
+        gevent.killall(workers)
+        if simulator:
+            simulator.terminate()
+        if not argv.keep:
+            remove_services(services)
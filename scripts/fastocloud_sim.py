@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import struct
+import time
+import zlib
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import gevent
+from gevent.server import StreamServer
+from pyfastocloud.client_constants import Commands
+
+PROJECT_NAME = 'fastocloud_sim'
+HEADER = struct.Struct('>I')
+
+
+class Framing:
+    NONE = 'none'
+    ZLIB = 'zlib'
+
+    ALL = [NONE, ZLIB]
+
+
+class NodeStatistics(object):
+    __slots__ = ['requests', 'responses', 'stream_stats', 'service_stats', 'streams']
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.stream_stats = 0
+        self.service_stats = 0
+        self.streams = 0
+
+    def __str__(self):
+        return 'requests:{0} responses:{1} stream_stats:{2} service_stats:{3} streams:{4}'.format(
+            self.requests, self.responses, self.stream_stats, self.service_stats, self.streams)
+
+
+class NodeConnection(object):
+    def __init__(self, sock, framing: str, stats: NodeStatistics, stream_rate: float, service_rate: float,
+                 ping_interval: float, burst: bool):
+        self._sock = sock
+        self._framing = framing
+        self._stats = stats
+        self._stream_rate = stream_rate
+        self._service_rate = service_rate
+        self._ping_interval = ping_interval
+        self._burst = burst
+        self._request_id = 0
+        self._streams = {}
+        self._start_time = int(time.time() * 1000)
+        self._workers = []
+
+    def run(self):
+        try:
+            while True:
+                message = self.__recv()
+                if message is None:
+                    break
+                self.__process(message)
+        except (OSError, ValueError) as e:
+            print('Caught exception on node connection: {0}'.format(e))
+        finally:
+            gevent.killall(self._workers)
+            self._stats.streams -= len(self._streams)
+            self._sock.close()
+
+    # private
+    def __process(self, message: dict):
+        method = message.get('method')
+        if not method:
+            # answer to one of our own requests (ping)
+            self._stats.responses += 1
+            return
+
+        self._stats.requests += 1
+        params = message.get('params') or {}
+        result = 'OK'
+        if method == Commands.ACTIVATE_COMMAND:
+            result = self.__activate_result()
+            self.__start_workers()
+        elif method == Commands.PREPARE_SERVICE_COMMAND:
+            result = [{'vods_in_directory': {'path': '/tmp', 'content': []}}]
+        elif method == Commands.SYNC_SERVICE_COMMAND:
+            for stream in params.get('streams', []):
+                sid = stream.get('id')
+                if sid and sid not in self._streams:
+                    self._streams[sid] = self.__make_stream_state()
+                    self._stats.streams += 1
+
+        if 'id' in message:
+            self.__send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+
+    def __start_workers(self):
+        if self._workers:
+            return
+
+        self._workers.append(gevent.spawn(self.__stream_stats_loop))
+        self._workers.append(gevent.spawn(self.__service_stats_loop))
+        if self._ping_interval > 0:
+            self._workers.append(gevent.spawn(self.__ping_loop))
+
+    def __stream_stats_loop(self):
+        # rate is per stream, spread the whole set evenly over one period unless bursting
+        period = 1.0 / self._stream_rate
+        while True:
+            sids = list(self._streams.keys())
+            if not sids:
+                gevent.sleep(period)
+                continue
+
+            if self._burst:
+                start = time.monotonic()
+                for sid in sids:
+                    self.__notify(Commands.STATISTIC_STREAM_COMMAND, self.__stream_statistic(sid, self._streams[sid]))
+                    self._stats.stream_stats += 1
+                gevent.sleep(max(0.0, period - (time.monotonic() - start)))
+                continue
+
+            step = period / len(sids)
+            for sid in sids:
+                state = self._streams.get(sid)
+                if state:
+                    self.__notify(Commands.STATISTIC_STREAM_COMMAND, self.__stream_statistic(sid, state))
+                    self._stats.stream_stats += 1
+                gevent.sleep(step)
+
+    def __service_stats_loop(self):
+        period = 1.0 / self._service_rate
+        while True:
+            self.__notify(Commands.STATISTIC_SERVICE_COMMAND, self.__service_statistic())
+            self._stats.service_stats += 1
+            gevent.sleep(period)
+
+    def __ping_loop(self):
+        while True:
+            gevent.sleep(self._ping_interval)
+            self.__request(Commands.CLIENT_PING_COMMAND, {'timestamp': self.__now()})
+
+    def __make_stream_state(self) -> dict:
+        return {'restarts': 0, 'start_time': self.__now(), 'loop_start_time': self.__now()}
+
+    def __stream_statistic(self, sid: str, state: dict) -> dict:
+        now = self.__now()
+        if random.random() < 0.001:
+            state['restarts'] += 1
+            state['loop_start_time'] = now
+        bps = random.randint(1000000, 8000000)
+        return {'id': sid, 'status': 4, 'cpu': random.uniform(0, 10), 'rss': random.randint(50, 200) * 1024 * 1024,
+                'restarts': state['restarts'], 'timestamp': now, 'idle_time': 0,
+                'start_time': state['start_time'], 'loop_start_time': state['loop_start_time'],
+                'input_streams': [{'id': 0, 'last_update': now, 'prev_bps': bps, 'bps': bps}],
+                'output_streams': [{'id': 0, 'last_update': now, 'prev_bps': bps, 'bps': bps}]}
+
+    def __service_statistic(self) -> dict:
+        now = self.__now()
+        return {'id': 'sim', 'cpu': random.uniform(0, 100), 'gpu': 0, 'load_average': '1.00 1.00 1.00',
+                'memory_total': 16 * 1024 * 1024 * 1024, 'memory_free': random.randint(1, 8) * 1024 * 1024 * 1024,
+                'hdd_total': 512 * 1024 * 1024 * 1024, 'hdd_free': 256 * 1024 * 1024 * 1024,
+                'bandwidth_in': random.randint(1, 1000) * 1024 * 1024,
+                'bandwidth_out': random.randint(1, 1000) * 1024 * 1024, 'uptime': (now - self._start_time) // 1000,
+                'timestamp': now,
+                'online_users': {'daemon': 1, 'http': 0, 'vods': 0, 'cods': 0, 'subscribers': 0}}
+
+    def __activate_result(self) -> dict:
+        result = self.__service_statistic()
+        result.update({'http_host': 'http://127.0.0.1:8000', 'vods_host': 'http://127.0.0.1:7000',
+                       'cods_host': 'http://127.0.0.1:6000', 'subscribers_host': None, 'bandwidth_host': None,
+                       'version': 'simulator', 'os': {'name': 'Linux', 'version': 'sim', 'arch': 'x86_64'}})
+        return result
+
+    def __notify(self, method: str, params: dict):
+        self.__send({'jsonrpc': '2.0', 'method': method, 'params': params})
+
+    def __request(self, method: str, params: dict):
+        self._request_id += 1
+        self.__send({'jsonrpc': '2.0', 'id': '{0:016x}'.format(self._request_id), 'method': method,
+                     'params': params})
+
+    def __send(self, message: dict):
+        data = json.dumps(message).encode('utf-8')
+        if self._framing == Framing.ZLIB:
+            data = zlib.compress(data)
+        self._sock.sendall(HEADER.pack(len(data)) + data)
+
+    def __recv(self):
+        header = self.__recv_exact(HEADER.size)
+        if not header:
+            return None
+
+        data = self.__recv_exact(HEADER.unpack(header)[0])
+        if data is None:
+            return None
+        if self._framing == Framing.ZLIB:
+            data = zlib.decompress(data)
+        return json.loads(data.decode('utf-8'))
+
+    def __recv_exact(self, size: int):
+        chunks = []
+        while size:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    @staticmethod
+    def __now() -> int:
+        return int(time.time() * 1000)
+
+
+def start_nodes(host: str, port: int, nodes: int, framing: str, stream_rate: float, service_rate: float,
+                ping_interval: float, burst: bool) -> (list, NodeStatistics):
+    stats = NodeStatistics()
+
+    def handle(sock, address):
+        NodeConnection(sock, framing, stats, stream_rate, service_rate, ping_interval, burst).run()
+
+    servers = []
+    for i in range(nodes):
+        server = StreamServer((host, port + i), handle)
+        server.start()
+        servers.append(server)
+    return servers, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
+    parser.add_argument('--host', help='listen host (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--port', help='first listen port, nodes use consecutive ports (default: 6317)', type=int,
+                        default=6317)
+    parser.add_argument('--nodes', help='number of simulated nodes (default: 1)', type=int, default=1)
+    parser.add_argument('--stream_rate', help='statistic messages per stream per second (default: 1)', type=float,
+                        default=1.0)
+    parser.add_argument('--service_rate', help='service statistic messages per second (default: 0.2)', type=float,
+                        default=0.2)
+    parser.add_argument('--ping_interval', help='seconds between client pings, 0 disables (default: 30)',
+                        type=float, default=30)
+    parser.add_argument('--framing', help='payload encoding after the length header (default: zlib)',
+                        choices=Framing.ALL, default=Framing.ZLIB)
+    parser.add_argument('--burst', help='send statistics of all streams back to back once per period',
+                        action='store_true')
+    parser.add_argument('--report_interval', help='seconds between reports (default: 5)', type=float, default=5)
+
+    argv = parser.parse_args()
+
+    nodes, node_stats = start_nodes(argv.host, argv.port, argv.nodes, argv.framing, argv.stream_rate,
+                                    argv.service_rate, argv.ping_interval, argv.burst)
+    print('Listening {0} nodes on {1}:{2}-{3}'.format(argv.nodes, argv.host, argv.port, argv.port + argv.nodes - 1))
+    try:
+        while True:
+            gevent.sleep(argv.report_interval)
+            print(node_stats)
+    except KeyboardInterrupt:
+        for node in nodes:
+            node.stop()
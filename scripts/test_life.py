@@ -2,33 +2,67 @@
 import argparse
 import os
 import sys
+from itertools import islice
 from mongoengine import connect
+import requests
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from app.common.stream.entry import TestLifeStream
 from app.service.service import ServiceSettings
-from app.common.utils.m3u_parser import M3uParser
+from app.service.m3u_stream_parser import M3uStreamParser
+from app.service.stream_importer import StreamImporter, StreamImportError, ImportResult
 
 PROJECT_NAME = 'test_life'
+CHUNK_SIZE = 500
+
+
+def read_lines(uri: str):
+    if os.path.exists(uri):
+        with open(uri, 'rb') as f:
+            yield from f
+        return
+
+    with requests.get(uri, stream=True) as resp:
+        resp.raise_for_status()
+        yield from resp.iter_lines()
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
     parser.add_argument('uri', help='Uri to m3u8 list')
     parser.add_argument('mongo_uri', help='MongoDB credentials')
+    parser.add_argument('--offset', help='number of already imported entries to skip (default: 0)', type=int,
+                        default=0)
 
     argv = parser.parse_args()
 
     mongo = connect(argv.mongo_uri)
     if mongo:
         service_settings = ServiceSettings.objects().first()
-        m3u_parser = M3uParser()
-        m3u_parser.read_m3u(argv.uri)
-        m3u_parser.parse()
-        for file in m3u_parser.files:
-            stream = TestLifeStream.make_stream(service_settings)
-            stream.input.urls[0].uri = file['link']
-            stream.name = '{0}({1})'.format(file['tvg-group'], file['title'])
-            service_settings.streams.append(stream)
-
-        service_settings.save()
+        importer = StreamImporter(service_settings)
+        total = ImportResult()
+        processed = argv.offset
+        entries = islice(M3uStreamParser().parse(read_lines(argv.uri)), processed, None)
+        while True:
+            chunk = list(islice(entries, CHUNK_SIZE))
+            if not chunk:
+                break
+
+            streams = []
+            for file in chunk:
+                stream = TestLifeStream.make_stream(service_settings)
+                stream.input.urls[0].uri = file['link']
+                stream.name = '{0}({1})'.format(file['tvg-group'], file['title'])
+                streams.append(stream)
+
+            try:
+                result, _ = importer.insert(streams)
+            except StreamImportError as e:
+                print('Failed to write entries after {0}, rerun with --offset {0}: {1}'.format(processed, e))
+                sys.exit(1)
+            total.merge(result)
+            processed += len(chunk)
+            print('Processed entries: {0}, {1}'.format(processed, result))
+
+        print('Imported streams, {0}'.format(total))
@@ -14,6 +14,11 @@ def servers_refresh():
     servers_manager.refresh()
 
 
+def servers_connect():
+    if app.config.get('SERVICE_CONNECT_ON_STARTUP', True):
+        servers_manager.connect_all()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
     parser.add_argument('--port', help='port (default: {0})'.format(PORT), default=PORT)
@@ -23,6 +28,7 @@ if __name__ == '__main__':
     http_server = WSGIServer((argv.host, argv.port), app)
     srv_greenlet = gevent.spawn(http_server.serve_forever)
     alarm_greenlet = gevent.spawn(servers_refresh)
+    gevent.spawn(servers_connect)
 
     try:
         gevent.joinall([srv_greenlet, alarm_greenlet])
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+os.environ['IPTV_ADMIN_SERVICE_DAEMON'] = '1'
+
+from app import app, servers_manager
+from app.service.ipc import IpcServer
+import gevent
+
+PROJECT_NAME = 'iptv_admin_service_daemon'
+SOCKET_PATH = app.config.get('SERVICE_MANAGER_SOCKET') or '/tmp/iptv_admin.sock'
+
+
+def servers_refresh():
+    servers_manager.refresh()
+
+
+def servers_connect():
+    if app.config.get('SERVICE_CONNECT_ON_STARTUP', True):
+        servers_manager.connect_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
+    parser.add_argument('--socket', help='unix socket path (default: {0})'.format(SOCKET_PATH), default=SOCKET_PATH)
+    argv = parser.parse_args()
+
+    ipc_server = IpcServer(argv.socket, servers_manager)
+    ipc_greenlet = gevent.spawn(ipc_server.serve_forever)
+    alarm_greenlet = gevent.spawn(servers_refresh)
+    gevent.spawn(servers_connect)
+
+    try:
+        gevent.joinall([ipc_greenlet, alarm_greenlet])
+    except KeyboardInterrupt:
+        servers_manager.stop()
+        ipc_server.stop()
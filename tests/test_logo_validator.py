@@ -0,0 +1,132 @@
+import importlib.util
+import os
+import threading
+import time
+import unittest
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('gevent')
+
+# importing through the app package would build the whole flask app, load the module on its own
+MODULE_PATH = os.path.join(os.path.dirname(__file__), '..', 'app', 'service', 'logo_validator.py')
+spec = importlib.util.spec_from_file_location('logo_validator', MODULE_PATH)
+logo_validator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(logo_validator)
+LogoValidator = logo_validator.LogoValidator
+
+
+def check_url(url: str, timeout) -> bool:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout) as resp:
+            return resp.status == 200
+    except (OSError, ValueError):
+        return False
+
+
+class LogoHandler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    hits = {}
+
+    def do_GET(self):
+        self.__serve(True)
+
+    def do_HEAD(self):
+        self.__serve(False)
+
+    def log_message(self, format, *args):
+        pass
+
+    # private
+    def __serve(self, with_body: bool):
+        cls = LogoHandler
+        with cls.lock:
+            cls.hits[self.path] = cls.hits.get(self.path, 0) + 1
+        if self.path.startswith('/slow/'):
+            time.sleep(0.2)
+
+        if self.path.endswith('.png'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            if with_body:
+                self.wfile.write(b'\x89PNG')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.hits = {}
+
+
+class LogoValidatorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), LogoHandler)
+        cls.base_url = 'http://127.0.0.1:{0}'.format(cls.server.server_address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        LogoHandler.reset()
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def test_valid_and_invalid(self):
+        validator = LogoValidator(timeout=2, checker=check_url)
+        valid, missing = self.url('/logo.png'), self.url('/missing')
+        result = validator.validate([valid, missing])
+        self.assertTrue(result[valid])
+        self.assertFalse(result[missing])
+
+    def test_unreachable_host_is_invalid(self):
+        validator = LogoValidator(timeout=1, checker=check_url)
+        self.assertFalse(validator.is_valid('http://127.0.0.1:1/logo.png'))
+
+    def test_per_host_cap(self):
+        # counted around the checker, the server side count lags behind the client releasing its slot
+        lock = threading.Lock()
+        counts = {'active': 0, 'max': 0}
+
+        def counting_check(url: str, timeout) -> bool:
+            with lock:
+                counts['active'] += 1
+                counts['max'] = max(counts['max'], counts['active'])
+            try:
+                return check_url(url, timeout)
+            finally:
+                with lock:
+                    counts['active'] -= 1
+
+        validator = LogoValidator(workers=8, per_host=2, timeout=2, checker=counting_check)
+        urls = [self.url('/slow/{0}.png'.format(i)) for i in range(8)]
+        result = validator.validate(urls)
+        self.assertTrue(all(result.values()))
+        self.assertEqual(counts['max'], 2)
+
+    def test_ttl_cache(self):
+        validator = LogoValidator(ttl=0.5, timeout=2, checker=check_url)
+        url = self.url('/cached.png')
+        self.assertTrue(validator.is_valid(url))
+        self.assertTrue(validator.is_valid(url))
+        self.assertEqual(LogoHandler.hits.get('/cached.png'), 1)
+
+        time.sleep(0.6)
+        self.assertTrue(validator.is_valid(url))
+        self.assertEqual(LogoHandler.hits.get('/cached.png'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()